@@ -5,27 +5,52 @@ gRPC ASGI Django demo server implementation.
 import argparse
 import asyncio
 import logging
+import signal
+import sys
+from typing import Optional
 
-from django.conf import settings
 import grpc
 from grpc_health.v1 import health, health_pb2, health_pb2_grpc
 from grpc_reflection.v1alpha import reflection
 
 from grpc_asgi_django_demo.proto.v1 import service_pb2_grpc
-from .django.asgi import application
-from . import asgi_impl, demo_impl
-
-_cleanup_coroutines = []
+from . import supervisor
 
 
 async def start() -> None:
     """Starts the server."""
+    # Import here, because this sets up Django, which the supervisor doesn't
+    # need.
+    from django.conf import settings
+    from .django.asgi import application
+    from . import admin_impl, asgi_impl, demo_impl, interceptors
+    from .asgi_pool import PooledApplication
+    from .capture import TrafficRecorder
+    from .memory_profile import MemoryProfiler
+    from .watchdog import LoopWatchdog
+    from .secret_store import secret_store
+
     logging.info("Starting server...")
-    server = grpc.aio.server()
+    profiler: Optional[MemoryProfiler] = None
+    if settings.MEMORY_PROFILING:
+        # Django is already imported by now, so its start-up allocations
+        # aren't traced.
+        profiler = MemoryProfiler(settings.MEMORY_PROFILING_FRAMES)
+
+    server_interceptors = interceptors.load_interceptors()
+    server = grpc.aio.server(interceptors=server_interceptors)
     # Import here, because Django does some initialisation
     from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler  # type: ignore
 
-    asgi = ASGIStaticFilesHandler(application)
+    local_asgi = ASGIStaticFilesHandler(application)
+    pool: Optional[PooledApplication] = None
+    if settings.ASGI_WORKER_MODE:
+        asgi = pool = PooledApplication(
+            settings.ASGI_WORKER_MODE,
+            settings.ASGI_WORKERS,
+        )
+    else:
+        asgi = local_asgi
 
     health_servicer = health.aio.HealthServicer()  # type: ignore
 
@@ -42,8 +67,23 @@ async def start() -> None:
         settings.GRPC_BIND_ADDR,
     )
 
+    recorder = None
+    if settings.TRAFFIC_CAPTURE_PATH:
+        recorder = TrafficRecorder(
+            settings.TRAFFIC_CAPTURE_PATH,
+            sample_rate=settings.TRAFFIC_CAPTURE_SAMPLE_RATE,
+            redact_headers=settings.TRAFFIC_CAPTURE_REDACT_HEADERS,
+            skip_paths=settings.TRAFFIC_CAPTURE_SKIP_PATHS,
+        )
+
+    asgi_service = asgi_impl.AsgiServiceImpl(
+        asgi_application=asgi,
+        port=port,
+        recorder=recorder,
+        profiler=profiler,
+    )
     service_pb2_grpc.add_AsgiServiceServicer_to_server(
-        asgi_impl.AsgiServiceImpl(asgi_application=asgi, port=port),
+        asgi_service,
         server,
     )
     await health_servicer.set(
@@ -51,6 +91,18 @@ async def start() -> None:
         health_pb2.HealthCheckResponse.SERVING,
     )
 
+    # Envoy doesn't transcode AsgiWebSocketService, so it needs a trusted
+    # WebSocket-to-gRPC bridge in front of the server.
+    service_pb2_grpc.add_AsgiWebSocketServiceServicer_to_server(
+        # Pooled workers only handle HTTP, so WebSockets always run here.
+        asgi_impl.AsgiWebSocketServiceImpl(asgi_application=local_asgi, port=port),
+        server,
+    )
+    await health_servicer.set(
+        asgi_impl.WEBSOCKET_SERVICE_NAME,
+        health_pb2.HealthCheckResponse.SERVING,
+    )
+
     health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
 
     reflection.enable_server_reflection(
@@ -62,32 +114,123 @@ async def start() -> None:
         server,
     )
 
-    async def graceful_shutdown():
-        logging.info("Shutting down...")
-        await server.stop(5)
+    # Reload rotated secrets without restarting
+    secret_watcher = asyncio.create_task(
+        secret_store.watch(settings.SECRETS_POLL_INTERVAL)
+    )
+
+    # Report AsgiService as NOT_SERVING when the event loop is blocked
+    watchdog = LoopWatchdog(
+        health_servicer,
+        asgi_impl.SERVICE_NAME,
+        interval=settings.LOOP_WATCHDOG_INTERVAL,
+        slow_callback=settings.LOOP_WATCHDOG_SLOW_CALLBACK,
+        unhealthy_lag=settings.LOOP_WATCHDOG_UNHEALTHY_LAG,
+        unhealthy_period=settings.LOOP_WATCHDOG_UNHEALTHY_PERIOD,
+        recovery_period=settings.LOOP_WATCHDOG_RECOVERY_PERIOD,
+        report_interval=settings.LOOP_WATCHDOG_REPORT_INTERVAL,
+    )
+    watchdog_task = asyncio.create_task(watchdog.run())
+
+    # Envoy doesn't route AdminService, so it's only reachable by connecting to
+    # the server directly.
+    service_pb2_grpc.add_AdminServiceServicer_to_server(
+        admin_impl.AdminServiceImpl(
+            watchdog,
+            profiler=profiler,
+            latency=next(
+                (
+                    i
+                    for i in server_interceptors
+                    if isinstance(i, interceptors.LatencyInterceptor)
+                ),
+                None,
+            ),
+        ),
+        server,
+    )
 
-    _cleanup_coroutines.append(graceful_shutdown())
+    async def graceful_shutdown(handover: bool):
+        watchdog_task.cancel()
+        secret_watcher.cancel()
+
+        if not handover:
+            # Tell Envoy to stop sending us traffic, and give it a chance to
+            # notice.
+            #
+            # This is skipped when handing over to a new worker: it shares our
+            # port, so Envoy would see the whole server as unhealthy.
+            logging.info(
+                "Draining, waiting %.1f seconds for health checks...",
+                settings.GRPC_DRAIN_DELAY,
+            )
+            await health_servicer.enter_graceful_shutdown()
+            await asyncio.sleep(settings.GRPC_DRAIN_DELAY)
+
+        # Stop accepting new connections and RPCs, and wait for in-flight ones
+        # to finish.
+        logging.info(
+            "Shutting down, waiting up to %.1f seconds for %d in-flight requests...",
+            settings.GRPC_SHUTDOWN_GRACE,
+            asgi_service.in_flight,
+        )
+        await server.stop(settings.GRPC_SHUTDOWN_GRACE)
+        if pool is not None:
+            pool.close()
+
+    async def immediate_shutdown():
+        await server.stop(None)
+        if pool is not None:
+            pool.close()
+
+    shutdown_task: Optional[asyncio.Task[None]] = None
+
+    def on_shutdown_signal(handover: bool):
+        nonlocal shutdown_task
+        if shutdown_task is None:
+            shutdown_task = asyncio.create_task(graceful_shutdown(handover))
+            return
+
+        # A second signal means "stop now", eg: pressing Ctrl-C again.
+        logging.warning("Stopping immediately, cancelling in-flight requests")
+        shutdown_task.cancel()
+        shutdown_task = asyncio.create_task(immediate_shutdown())
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, on_shutdown_signal, False)
+    loop.add_signal_handler(signal.SIGTERM, on_shutdown_signal, False)
+    loop.add_signal_handler(supervisor.HANDOVER_SIGNAL, on_shutdown_signal, True)
 
     await server.start()
     logging.info("Server is listening at port :%d", port)
+    supervisor.notify_ready()
     await server.wait_for_termination()
+    if shutdown_task is not None:
+        await shutdown_task
+    if recorder is not None:
+        await asyncio.to_thread(recorder.close)
 
 
 def main():
     """Main entrypoint."""
     parser = argparse.ArgumentParser()
-    _ = parser.parse_args()
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Run the server in this process, without a supervisor. "
+        "The supervisor reloads the server without downtime on SIGHUP.",
+    )
+    args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
 
     loop = asyncio.new_event_loop()
     try:
-        loop.run_until_complete(start())
-    except KeyboardInterrupt:
-        pass
+        if args.worker:
+            loop.run_until_complete(start())
+        else:
+            sys.exit(loop.run_until_complete(supervisor.supervise()))
     finally:
-        if _cleanup_coroutines:
-            loop.run_until_complete(*_cleanup_coroutines)
         loop.close()
 
 
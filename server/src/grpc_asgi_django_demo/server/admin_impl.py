@@ -0,0 +1,135 @@
+import asyncio
+import tracemalloc
+from typing import Optional
+
+import grpc
+
+from grpc_asgi_django_demo.proto.v1 import service_pb2, service_pb2_grpc
+from .interceptors import LatencyInterceptor
+from .memory_profile import MemoryProfiler
+from .watchdog import LoopWatchdog
+
+
+SERVICE_NAME = service_pb2.DESCRIPTOR.services_by_name["AdminService"].full_name
+
+_DEFAULT_LIMIT = 20
+
+
+def _allocation_site(
+    stat: tracemalloc.Statistic | tracemalloc.StatisticDiff,
+) -> service_pb2.AllocationSite:
+    frame = stat.traceback[0]
+    site = service_pb2.AllocationSite(
+        filename=frame.filename,
+        lineno=frame.lineno,
+        size_bytes=stat.size,
+        count=stat.count,
+    )
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        site.size_diff_bytes = stat.size_diff
+        site.count_diff = stat.count_diff
+    return site
+
+
+class AdminServiceImpl(service_pb2_grpc.AdminServiceServicer):
+    def __init__(
+        self,
+        watchdog: LoopWatchdog,
+        profiler: Optional[MemoryProfiler] = None,
+        latency: Optional[LatencyInterceptor] = None,
+    ):
+        """
+        Args:
+            watchdog: Event loop watchdog to report lag from.
+            profiler: Memory profiler to report from, if memory profiling is
+                enabled.
+            latency: Latency interceptor to report from, if it is installed.
+        """
+        self._watchdog = watchdog
+        self._profiler = profiler
+        self._latency = latency
+
+    async def MemoryReport(
+        self,
+        request: service_pb2.MemoryReportRequest,
+        context: grpc.aio.ServicerContext,
+    ) -> service_pb2.MemoryReportResponse:
+        if self._profiler is None:
+            return await context.abort(
+                grpc.StatusCode.FAILED_PRECONDITION,
+                "memory profiling is disabled, set MEMORY_PROFILING",
+            )
+        if request.limit < 0:
+            return await context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT,
+                "`limit` must be non-negative",
+            )
+
+        routes = self._profiler.routes(reset=request.reset_routes)
+        # Taking a snapshot is slow, so keep the event loop responsive.
+        report = await asyncio.to_thread(
+            self._profiler.snapshot, request.limit or _DEFAULT_LIMIT
+        )
+
+        return service_pb2.MemoryReportResponse(
+            traced_bytes=report.traced_bytes,
+            peak_traced_bytes=report.peak_traced_bytes,
+            top_allocations=[_allocation_site(s) for s in report.top_allocations],
+            growth=[_allocation_site(s) for s in report.growth],
+            routes=[
+                service_pb2.RouteMemory(
+                    route=route,
+                    requests=stats.requests,
+                    net_bytes=stats.net_bytes,
+                    peak_request_bytes=stats.peak_request_bytes,
+                    peak_buffered_bytes=stats.peak_buffered_bytes,
+                )
+                for route, stats in sorted(routes.items())
+            ],
+        )
+
+    async def LoopLag(
+        self,
+        request: service_pb2.LoopLagRequest,
+        context: grpc.aio.ServicerContext,
+    ) -> service_pb2.LoopLagResponse:
+        percentiles = self._watchdog.lag_percentiles()
+        return service_pb2.LoopLagResponse(
+            p50_seconds=percentiles.get("p50", 0.0),
+            p90_seconds=percentiles.get("p90", 0.0),
+            p99_seconds=percentiles.get("p99", 0.0),
+            max_seconds=percentiles.get("max", 0.0),
+            serving=self._watchdog.serving,
+            slow_callbacks=[
+                service_pb2.SlowCallback(
+                    started=c.started,
+                    duration_seconds=c.duration,
+                    stack=c.stack,
+                )
+                for c in list(self._watchdog.slow_callbacks)
+            ],
+        )
+
+    async def CallLatency(
+        self,
+        request: service_pb2.CallLatencyRequest,
+        context: grpc.aio.ServicerContext,
+    ) -> service_pb2.CallLatencyResponse:
+        if self._latency is None:
+            return await context.abort(
+                grpc.StatusCode.FAILED_PRECONDITION,
+                "LatencyInterceptor isn't in GRPC_SERVER_INTERCEPTORS",
+            )
+
+        return service_pb2.CallLatencyResponse(
+            methods=[
+                service_pb2.MethodLatency(
+                    method=method,
+                    count=stats.count,
+                    errors=stats.errors,
+                    mean_seconds=stats.mean_ns / 1_000_000_000,
+                    max_seconds=stats.max_ns / 1_000_000_000,
+                )
+                for method, stats in sorted(self._latency.stats.items())
+            ]
+        )
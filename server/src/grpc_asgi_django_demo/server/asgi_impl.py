@@ -1,20 +1,29 @@
 import asyncio
 import logging
-from typing import Iterable, NoReturn, Optional, cast
+import time
+from typing import AsyncIterator, NoReturn, Optional, cast
 
 from asgiref.typing import (
     ASGI3Application,
     ASGIReceiveCallable,
     ASGISendCallable,
+    ASGISendEvent,
     HTTPScope,
     HTTPRequestEvent,
     HTTPDisconnectEvent,
+    WebSocketScope,
+    WebSocketConnectEvent,
+    WebSocketReceiveEvent,
+    WebSocketDisconnectEvent,
 )
 from google.api import httpbody_pb2
 import grpc
 from httpx import URL
 
 from grpc_asgi_django_demo.proto.v1 import service_pb2, service_pb2_grpc
+from .capture import TrafficRecorder
+from .headers import status_metadata, translate_response_headers
+from .memory_profile import MemoryProfiler
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.INFO)
@@ -23,7 +32,23 @@ _HTTP_DISCONNECT_EVENT: HTTPDisconnectEvent = {
     "type": "http.disconnect",
 }
 
+_WEBSOCKET_CONNECT_EVENT: WebSocketConnectEvent = {
+    "type": "websocket.connect",
+}
+
+# Maximum number of WebSocket messages from the client waiting for the
+# application to receive them. When this is full, we stop reading from the gRPC
+# stream, so HTTP/2 flow control pushes back on the client.
+_WEBSOCKET_RECEIVE_QUEUE_SIZE = 16
+
+# Close code when the client ends its stream without a close message
+# (RFC 6455 section 7.4.1: "No Status Rcvd").
+_WEBSOCKET_CLOSE_NO_STATUS = 1005
+
 SERVICE_NAME = service_pb2.DESCRIPTOR.services_by_name["AsgiService"].full_name
+WEBSOCKET_SERVICE_NAME = service_pb2.DESCRIPTOR.services_by_name[
+    "AsgiWebSocketService"
+].full_name
 
 
 def metadata_value_to_str(value: str | bytes) -> str:
@@ -188,6 +213,50 @@ async def context_to_scope(
     }
 
 
+async def context_to_websocket_scope(
+    context: grpc.aio.ServicerContext,
+    port: int,
+) -> WebSocketScope | NoReturn:
+    """
+    Converts a gRPC `ServicerContext` containing a WebSocket upgrade request
+    into an [ASGI `WebSocketScope`](https://asgi.readthedocs.io/en/latest/specs/www.html#websocket-connection-scope).
+
+    This uses the same HTTP headers as `context_to_scope()`, and has the same
+    security caveats.
+
+    Raises:
+        Exception: On invalid inputs, and aborts the RPC with `context.abort()`.
+    """
+    http_scope = await context_to_scope(context, "", port)
+
+    subprotocols: list[str] = []
+    for k, v in http_scope["headers"]:
+        if k == b"sec-websocket-protocol":
+            subprotocols.extend(
+                p.strip() for p in v.decode("latin1").split(",") if p.strip()
+            )
+
+    # https://asgi.readthedocs.io/en/latest/specs/www.html#websocket-connection-scope
+    return {
+        "type": "websocket",
+        "asgi": {
+            "version": "3.0",
+            "spec_version": "2.3",
+        },
+        "http_version": http_scope["http_version"],
+        "scheme": "wss" if http_scope["scheme"] == "https" else "ws",
+        "path": http_scope["path"],
+        "raw_path": http_scope["raw_path"],
+        "query_string": http_scope["query_string"],
+        "root_path": http_scope["root_path"],
+        "headers": http_scope["headers"],
+        "client": http_scope["client"],
+        "server": http_scope["server"],
+        "subprotocols": subprotocols,
+        "extensions": {},
+    }
+
+
 def http_body_to_asgi_request(request: httpbody_pb2.HttpBody) -> HTTPRequestEvent:
     """
     Converts a `HttpBody` into an
@@ -268,10 +337,99 @@ class Recv:
         self._disconnect_signal.set()
 
 
+class WebSocketRecv:
+    """
+    WebSocket lifecycle message queue for an ASGI application.
+
+    The first event is always `websocket.connect`. This is followed by a
+    `websocket.receive` event for each message from the client, and finally a
+    `websocket.disconnect` event, which is then repeated for any further calls.
+
+    The queue is bounded, so `WebSocketRecv.put()` blocks while the application
+    is behind. `WebSocketRecv.disconnect()` never blocks.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue[
+            WebSocketConnectEvent | WebSocketReceiveEvent | WebSocketDisconnectEvent
+        ] = asyncio.Queue(maxsize=_WEBSOCKET_RECEIVE_QUEUE_SIZE)
+        self._queue.put_nowait(_WEBSOCKET_CONNECT_EVENT)
+        self._disconnect: Optional[WebSocketDisconnectEvent] = None
+
+    async def __call__(
+        self,
+    ) -> WebSocketConnectEvent | WebSocketReceiveEvent | WebSocketDisconnectEvent:
+        if self._disconnect is not None and self._queue.empty():
+            return self._disconnect
+        return await self._queue.get()
+
+    async def put(self, message: service_pb2.WebSocketMessage) -> bool:
+        """
+        Queues a message from the client for the application.
+
+        Returns:
+            `False` if this was a close message, and nothing more should be
+            read from the client.
+        """
+        which = message.WhichOneof("message")
+        if which == "bytes":
+            await self._queue.put(
+                {"type": "websocket.receive", "bytes": message.bytes, "text": None}
+            )
+        elif which == "text":
+            await self._queue.put(
+                {"type": "websocket.receive", "bytes": None, "text": message.text}
+            )
+        elif which == "close":
+            self.disconnect(message.close.code, message.close.reason)
+            return False
+        return True
+
+    def disconnect(self, code: int, reason: str = "") -> None:
+        """
+        Signal to the ASGI application that the WebSocket has been closed.
+
+        Further calls have no effect.
+        """
+        if self._disconnect is not None:
+            return
+        self._disconnect = {
+            "type": "websocket.disconnect",
+            "code": code,
+            "reason": reason,
+        }
+        # If the queue is full, the application isn't waiting on it, and will
+        # get the disconnect event once it has drained the queue.
+        if not self._queue.full():
+            self._queue.put_nowait(self._disconnect)
+
+
 class AsgiServiceImpl(service_pb2_grpc.AsgiServiceServicer):
-    def __init__(self, asgi_application: ASGI3Application, port: int):
+    def __init__(
+        self,
+        asgi_application: ASGI3Application,
+        port: int,
+        recorder: Optional[TrafficRecorder] = None,
+        profiler: Optional[MemoryProfiler] = None,
+    ):
+        """
+        Args:
+            asgi_application: ASGI application to serve.
+            port: TCP port that the gRPC server is listening on.
+            recorder: If set, samples `Handler` requests into a traffic capture
+                log.
+            profiler: If set, records the memory usage of `Handler` requests.
+        """
         self._app = asgi_application
         self._port = port
+        self._recorder = recorder
+        self._profiler = profiler
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Number of `Handler` calls currently being processed."""
+        return self._in_flight
 
     async def _call(
         self, scope: HTTPScope, recv: ASGIReceiveCallable, send: ASGISendCallable
@@ -283,6 +441,38 @@ class AsgiServiceImpl(service_pb2_grpc.AsgiServiceServicer):
         request: httpbody_pb2.HttpBody,
         context: grpc.aio.ServicerContext,
     ) -> httpbody_pb2.HttpBody:
+        self._in_flight += 1
+        try:
+            recorder = self._recorder
+            if recorder is None or not recorder.should_sample():
+                return (await self._handle(request, context))[1]
+
+            timestamp = time.time()
+            start = time.perf_counter()
+            status, response = await self._handle(request, context)
+            recorder.record(
+                timestamp=timestamp,
+                latency=time.perf_counter() - start,
+                metadata=context.invocation_metadata() or (),
+                request=request.SerializeToString(),
+                status=status,
+                response=response.SerializeToString(),
+            )
+            return response
+        finally:
+            self._in_flight -= 1
+
+    async def _handle(
+        self,
+        request: httpbody_pb2.HttpBody,
+        context: grpc.aio.ServicerContext,
+    ) -> tuple[int, httpbody_pb2.HttpBody]:
+        """
+        Handles a `Handler` call.
+
+        Returns:
+            The HTTP response status, and the response to send.
+        """
         # We're using a "custom" handler, so "Http()" is everything.
         # However, there's nothing in the spec to pass the original method
         # across - only Envoy extensions.
@@ -292,6 +482,10 @@ class AsgiServiceImpl(service_pb2_grpc.AsgiServiceServicer):
 
         _LOGGER.debug("Request headers: %r", scope["headers"])
 
+        profile = None
+        if self._profiler is not None:
+            profile = self._profiler.request(scope["path"])
+
         # Create receive and send queue that we'll send to the application
         receive_q = Recv(http_body_to_asgi_request(request))
         send_q = asyncio.Queue()
@@ -300,66 +494,176 @@ class AsgiServiceImpl(service_pb2_grpc.AsgiServiceServicer):
         _LOGGER.debug("Calling ASGI application...")
 
         response = httpbody_pb2.HttpBody()
-
-        async with asyncio.TaskGroup() as tg:
-            initial_metadata_task: Optional[asyncio.Task[None]] = None
-            app_task = tg.create_task(self._call(scope, receive_q, send_q.put))
-
-            started = False
-            more_body = True
-            _LOGGER.debug("Waiting for server to respond...")
-            while True:
-                evt = await send_q.get()
-                _LOGGER.debug("Got event %r", evt["type"])
-                if evt["type"] == "http.response.start":
-                    if started:
-                        raise ValueError(
-                            "app sent http.response.start when we've already started"
+        status = 0
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                initial_metadata_task: Optional[asyncio.Task[None]] = None
+                app_task = tg.create_task(self._call(scope, receive_q, send_q.put))
+
+                started = False
+                more_body = True
+                _LOGGER.debug("Waiting for server to respond...")
+                while True:
+                    evt = await send_q.get()
+                    _LOGGER.debug("Got event %r", evt["type"])
+                    if evt["type"] == "http.response.start":
+                        if started:
+                            raise ValueError(
+                                "app sent http.response.start when we've already started"
+                            )
+                        started = True
+                        status = evt["status"]
+
+                        headers, content_type = translate_response_headers(
+                            status, evt.get("headers", ())
                         )
-                    started = True
-
-                    headers: list[tuple[str, bytes]] = []
-                    headers.append(("x-http-code", str(evt["status"]).encode("latin1")))
-
-                    # Headers
-                    asgi_headers: Iterable[tuple[bytes, bytes]] = evt.get("headers", [])
-                    for k, v in asgi_headers:
-                        # Spec says "header names must be lowercased", but Django doesn't do this
-                        # gRPC requires them to be lowercased
-                        k = k.decode().lower()
-                        if k == "content-type":
-                            response.content_type = v.decode()
-                            continue
-
-                        headers.append((k, v))
-                    _LOGGER.debug("Sending metadata: %r", headers)
-                    initial_metadata_task = tg.create_task(
-                        context.send_initial_metadata(headers)
-                    )
-                elif evt["type"] == "http.response.body":
-                    if not more_body:
-                        raise ValueError(
-                            "app sent http.response.body when it said !more_body"
+                        if content_type is not None:
+                            response.content_type = content_type
+                        _LOGGER.debug("Sending metadata: %r", headers)
+                        initial_metadata_task = tg.create_task(
+                            context.send_initial_metadata(headers)
                         )
-                    more_body = evt.get("more_body", False)
-                    response.data += evt.get("body", b"")
-                else:
-                    _LOGGER.warning("unknown event type: %r", evt["type"])
+                    elif evt["type"] == "http.response.body":
+                        if not more_body:
+                            raise ValueError(
+                                "app sent http.response.body when it said !more_body"
+                            )
+                        more_body = evt.get("more_body", False)
+                        response.data += evt.get("body", b"")
+                    else:
+                        _LOGGER.warning("unknown event type: %r", evt["type"])
+
+                    send_q.task_done()
+                    if not more_body:
+                        break
 
-                send_q.task_done()
-                if not more_body:
-                    break
+                # Tell the app we're finished with it
+                _LOGGER.debug("Signalling client disconnect...")
+                receive_q.disconnect()
 
-            # Tell the app we're finished with it
-            _LOGGER.debug("Signalling client disconnect...")
-            receive_q.disconnect()
+                # Ensure initial metadata was sent to the client
+                if initial_metadata_task is not None:
+                    await initial_metadata_task
 
-            # Ensure initial metadata was sent to the client
-            if initial_metadata_task is not None:
-                await initial_metadata_task
-
-            _LOGGER.debug("Waiting for app_task to finish...")
-            await app_task
+                _LOGGER.debug("Waiting for app_task to finish...")
+                await app_task
+        finally:
+            # Count requests which failed too, as error paths can also leak.
+            if profile is not None:
+                profile.finish(len(request.data) + len(response.data))
 
         _LOGGER.debug("Returning response...")
-        return response
+        return status, response
+
+
+class AsgiWebSocketServiceImpl(service_pb2_grpc.AsgiWebSocketServiceServicer):
+    def __init__(self, asgi_application: ASGI3Application, port: int):
+        """
+        Args:
+            asgi_application: ASGI application to serve.
+            port: TCP port that the gRPC server is listening on.
+        """
+        self._app = asgi_application
+        self._port = port
+
+    async def Connect(
+        self,
+        request_iterator: AsyncIterator[service_pb2.WebSocketMessage],
+        context: grpc.aio.ServicerContext,
+    ) -> AsyncIterator[service_pb2.WebSocketMessage]:
+        # This reads from the client with context.read() rather than the
+        # iterator, and only takes one message at a time from the application,
+        # so that a slow application or client applies backpressure to the
+        # other side.
+        del request_iterator
+        scope = await context_to_websocket_scope(context, self._port)
+        _LOGGER.debug("WebSocket request headers: %r", scope["headers"])
+
+        receive_q = WebSocketRecv()
+        # Messages for the client, followed by `None` once the app has finished
+        send_q: asyncio.Queue[Optional[service_pb2.WebSocketMessage]] = asyncio.Queue()
+        accepted = False
+        closed = False
+
+        async def write(message: service_pb2.WebSocketMessage) -> None:
+            # Wait for the message to be sent to the client.
+            await send_q.put(message)
+            await send_q.join()
+
+        async def send(evt: ASGISendEvent) -> None:
+            nonlocal accepted, closed
+            if closed:
+                raise RuntimeError("app sent %r after websocket.close" % evt["type"])
+
+            if evt["type"] == "websocket.accept":
+                if accepted:
+                    raise ValueError("app sent websocket.accept twice")
+                accepted = True
+                headers, _ = translate_response_headers(101, evt.get("headers", ()))
+                subprotocol = evt.get("subprotocol")
+                if subprotocol:
+                    headers.append(
+                        ("sec-websocket-protocol", subprotocol.encode("latin1"))
+                    )
+                await context.send_initial_metadata(headers)
+            elif evt["type"] == "websocket.send":
+                if not accepted:
+                    raise ValueError("app sent websocket.send before websocket.accept")
+                data = evt.get("bytes")
+                if data is not None:
+                    await write(service_pb2.WebSocketMessage(bytes=data))
+                else:
+                    await write(
+                        service_pb2.WebSocketMessage(text=evt.get("text") or "")
+                    )
+            elif evt["type"] == "websocket.close":
+                closed = True
+                code = evt.get("code", 1000)
+                if not accepted:
+                    # Closing before accepting rejects the connection.
+                    await context.send_initial_metadata([status_metadata(403)])
+                else:
+                    await write(
+                        service_pb2.WebSocketMessage(
+                            close=service_pb2.WebSocketClose(
+                                code=code,
+                                reason=evt.get("reason") or "",
+                            )
+                        )
+                    )
+                receive_q.disconnect(code)
+            else:
+                _LOGGER.warning("unknown event type: %r", evt["type"])
+
+        async def pump() -> None:
+            # Forward messages from the client to the application.
+            while True:
+                message = await context.read()
+                if message is grpc.aio.EOF:  # type: ignore
+                    receive_q.disconnect(_WEBSOCKET_CLOSE_NO_STATUS)
+                    return
+                if not await receive_q.put(message):
+                    return
+
+        async def run_app() -> None:
+            async with asyncio.TaskGroup() as tg:
+                pump_task = tg.create_task(pump())
+                await self._app(scope, receive_q, send)
+                # The app has finished, so stop reading from the client.
+                pump_task.cancel()
+
+            if not accepted and not closed:
+                await context.send_initial_metadata([status_metadata(403)])
+
+        app_task = asyncio.create_task(run_app())
+        app_task.add_done_callback(lambda _: send_q.put_nowait(None))
+        try:
+            while (message := await send_q.get()) is not None:
+                yield message
+                send_q.task_done()
+            # Raise any exception from the app.
+            await app_task
+        finally:
+            # The client went away, or this failed.
+            app_task.cancel()
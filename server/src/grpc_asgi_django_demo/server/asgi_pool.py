@@ -0,0 +1,183 @@
+"""
+Experimental: run the ASGI application on several cores in one process.
+
+`PooledApplication` is an ASGI application which hands each HTTP request to a
+pool of workers, each of which hosts its own instance of Django's ASGI
+application, running on its own event loop. There are two kinds of worker:
+
+* `threads`: one thread per worker. This only runs on several cores at once
+  with a free-threaded build of Python (3.13+); otherwise the GIL serialises the
+  workers.
+
+* `interpreters`: one sub-interpreter per worker, using
+  `concurrent.futures.InterpreterPoolExecutor` (Python 3.14+). Each
+  sub-interpreter has its own GIL, but also its own copy of Django.
+
+Only plain data (the scope, request body and response) is passed between the
+gRPC server and workers, so no objects are shared between interpreters.
+
+Limitations:
+
+* Only `http` scopes are supported. The gRPC server runs WebSockets on its own
+  event loop instead.
+* The request and response bodies are buffered, rather than streamed.
+* Secrets are not reloaded inside sub-interpreters.
+
+This module is imported by sub-interpreters, so it must not import `grpc`.
+"""
+
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+import logging
+import sys
+import threading
+from typing import Any
+
+from asgiref.typing import (
+    ASGIReceiveCallable,
+    ASGISendCallable,
+    HTTPDisconnectEvent,
+    HTTPRequestEvent,
+    HTTPScope,
+)
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.INFO)
+
+WORKER_MODES = ("threads", "interpreters")
+
+# Per-worker state. For `interpreters` mode, each sub-interpreter has its own
+# copy of this module, so this is only ever used by one thread.
+_worker = threading.local()
+
+_Response = tuple[int, list[tuple[bytes, bytes]], bytes]
+
+
+def _init_worker() -> None:
+    """Sets up a worker's event loop and ASGI application."""
+    # Importing this sets up Django, if it hasn't been already.
+    from .django import asgi  # noqa: F401
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler  # type: ignore
+    from django.core.asgi import get_asgi_application
+
+    _worker.loop = asyncio.new_event_loop()
+    _worker.app = ASGIStaticFilesHandler(get_asgi_application())
+
+
+async def _call(app: Any, scope: HTTPScope, body: bytes) -> _Response:
+    request_sent = False
+    finished = asyncio.Event()
+    status = 0
+    headers: list[tuple[bytes, bytes]] = []
+    chunks: list[bytes] = []
+
+    async def receive() -> HTTPRequestEvent | HTTPDisconnectEvent:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(evt: Any) -> None:
+        nonlocal status, headers
+        if evt["type"] == "http.response.start":
+            status = evt["status"]
+            headers = [(bytes(k), bytes(v)) for k, v in evt.get("headers", [])]
+        elif evt["type"] == "http.response.body":
+            chunks.append(evt.get("body", b""))
+            if not evt.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return status, headers, b"".join(chunks)
+
+
+def run_request(scope: HTTPScope, body: bytes) -> _Response:
+    """
+    Runs a request on the current worker's ASGI application.
+
+    Returns:
+        The response status, headers and body.
+    """
+    return _worker.loop.run_until_complete(_call(_worker.app, scope, body))
+
+
+def _make_executor(mode: str, workers: int) -> Executor:
+    if mode == "threads":
+        if getattr(sys, "_is_gil_enabled", lambda: True)():
+            _LOGGER.warning(
+                "The GIL is enabled, so ASGI worker threads won't run in parallel"
+            )
+        return ThreadPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            thread_name_prefix="asgi-worker",
+        )
+
+    if mode == "interpreters":
+        try:
+            from concurrent.futures import InterpreterPoolExecutor  # type: ignore
+        except ImportError:
+            raise RuntimeError(
+                "ASGI worker interpreters need Python 3.14 or later"
+            ) from None
+        return InterpreterPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+    raise ValueError(f"Unknown ASGI worker mode: {mode!r}")
+
+
+class PooledApplication:
+    """
+    ASGI application which runs HTTP requests in a pool of workers.
+    """
+
+    def __init__(self, mode: str, workers: int):
+        """
+        Args:
+            mode: Kind of worker, one of `WORKER_MODES`.
+            workers: Number of workers.
+        """
+        self._executor = _make_executor(mode, workers)
+        _LOGGER.info("Running ASGI application in %d worker %s", workers, mode)
+
+    async def __call__(
+        self, scope: Any, receive: ASGIReceiveCallable, send: ASGISendCallable
+    ) -> None:
+        if scope["type"] != "http":
+            raise ValueError(f"Pooled ASGI workers can't handle {scope['type']!r}")
+
+        body = b""
+        while True:
+            evt = await receive()
+            if evt["type"] != "http.request":
+                # Client went away
+                return
+            body += evt.get("body", b"")
+            if not evt.get("more_body", False):
+                break
+
+        loop = asyncio.get_running_loop()
+        status, headers, response = await loop.run_in_executor(
+            self._executor, run_request, dict(scope), body
+        )
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": headers,
+                "trailers": False,
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": response,
+                "more_body": False,
+            }
+        )
+
+    def close(self) -> None:
+        """Shuts down the workers, without waiting for them."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
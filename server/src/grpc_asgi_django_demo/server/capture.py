@@ -0,0 +1,285 @@
+"""
+Traffic capture for `AsgiService.Handler`.
+
+`TrafficRecorder` samples incoming requests, and writes them (with their
+invocation metadata, and a summary of the response) to a compact binary log.
+This can be replayed against a server with `gadd-replay`.
+
+## Log format
+
+All integers are big-endian. A log file starts with `MAGIC`, followed by any
+number of records. Each record is:
+
+* `uint32`: length of the rest of the record
+* `float64`: request start time (`time.time()`)
+* `float64`: latency of the original response, in seconds
+* `uint16`: original HTTP response status
+* `uint32`: length of the original serialized `HttpBody` response
+* 32 bytes: SHA-256 digest of the original serialized `HttpBody` response
+* `uint16`: number of metadata entries, followed by that many entries of:
+  * `uint16`: key length, followed by the key
+  * `uint32`: value length, followed by the value
+* the rest of the record: the serialized `HttpBody` request
+
+Each record is written with a single `write()` call to a file opened for
+appending, so several processes can share a log. Records are written when each
+request finishes, so they aren't necessarily in the order the requests started.
+
+Records are encoded and written by a background thread, so capturing a request
+doesn't block the event loop on disk I/O.
+"""
+
+from dataclasses import dataclass
+import hashlib
+import logging
+import os
+import queue
+import random
+import struct
+import threading
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from google.api import httpbody_pb2
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.INFO)
+
+MAGIC = b"GADDCAP\x01"
+
+_LENGTH = struct.Struct(">I")
+_RECORD_HEADER = struct.Struct(">ddHI32s")
+_COUNT = struct.Struct(">H")
+_KEY_LENGTH = struct.Struct(">H")
+_VALUE_LENGTH = struct.Struct(">I")
+
+_REDACTED = b"REDACTED"
+
+# Maximum number of captured requests waiting to be written. Requests captured
+# while this is full are dropped.
+_WRITE_QUEUE_SIZE = 1024
+
+_PATH_HEADER = "x-envoy-original-path"
+
+# Arguments to TrafficRecorder.record()
+_Capture = tuple[float, float, Iterable[tuple[str, str | bytes]], bytes, int, bytes]
+
+
+@dataclass(slots=True)
+class Record:
+    """A captured request, and a summary of its original response."""
+
+    timestamp: float
+    latency: float
+    status: int
+    response_length: int
+    response_digest: bytes
+    metadata: list[tuple[str, bytes]]
+    request: bytes
+    """Serialized `HttpBody` request."""
+
+
+def encode_record(record: Record) -> bytes:
+    """Encodes a `Record`, including its length prefix."""
+    parts = [
+        _RECORD_HEADER.pack(
+            record.timestamp,
+            record.latency,
+            record.status,
+            record.response_length,
+            record.response_digest,
+        ),
+        _COUNT.pack(len(record.metadata)),
+    ]
+    for key, value in record.metadata:
+        k = key.encode("latin1")
+        parts += (_KEY_LENGTH.pack(len(k)), k, _VALUE_LENGTH.pack(len(value)), value)
+    parts.append(record.request)
+
+    body = b"".join(parts)
+    return _LENGTH.pack(len(body)) + body
+
+
+def decode_record(data: bytes) -> Record:
+    """Decodes a `Record`, without its length prefix."""
+    timestamp, latency, status, response_length, response_digest = (
+        _RECORD_HEADER.unpack_from(data)
+    )
+    offset = _RECORD_HEADER.size
+    (count,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+
+    metadata: list[tuple[str, bytes]] = []
+    for _ in range(count):
+        (key_length,) = _KEY_LENGTH.unpack_from(data, offset)
+        offset += _KEY_LENGTH.size
+        key = data[offset : offset + key_length].decode("latin1")
+        offset += key_length
+        (value_length,) = _VALUE_LENGTH.unpack_from(data, offset)
+        offset += _VALUE_LENGTH.size
+        metadata.append((key, data[offset : offset + value_length]))
+        offset += value_length
+
+    return Record(
+        timestamp=timestamp,
+        latency=latency,
+        status=status,
+        response_length=response_length,
+        response_digest=response_digest,
+        metadata=metadata,
+        request=data[offset:],
+    )
+
+
+def read_records(f: BinaryIO) -> Iterator[Record]:
+    """
+    Reads all `Record`s from a log file.
+
+    Raises:
+        ValueError: if `f` isn't a capture log.
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a traffic capture log")
+
+    while True:
+        prefix = f.read(_LENGTH.size)
+        if len(prefix) < _LENGTH.size:
+            return
+        (length,) = _LENGTH.unpack(prefix)
+        data = f.read(length)
+        if len(data) < length:
+            _LOGGER.warning("Ignoring truncated record at end of log")
+            return
+        yield decode_record(data)
+
+
+def digest_response(response: bytes) -> bytes:
+    """Digest of a serialized `HttpBody` response, for comparing responses."""
+    return hashlib.sha256(response).digest()
+
+
+class TrafficRecorder:
+    """
+    Samples requests into a traffic capture log.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        redact_headers: Iterable[str] = (),
+        skip_paths: Iterable[str] = (),
+    ):
+        """
+        Args:
+            path: Log file to append to.
+            sample_rate: Proportion of requests to capture, between 0 and 1.
+            redact_headers: Names of headers (metadata keys) whose values are
+                replaced in the log.
+            skip_paths: HTTP request paths (without a query string) whose
+                request bodies are left out of the log, eg: login forms.
+        """
+        self._sample_rate = sample_rate
+        self._redact_headers = frozenset(h.lower() for h in redact_headers)
+        self._skip_paths = frozenset(skip_paths)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, MAGIC)
+
+        self._queue: queue.Queue[Optional[_Capture]] = queue.Queue(
+            maxsize=_WRITE_QUEUE_SIZE
+        )
+        self._writer = threading.Thread(
+            target=self._write_records,
+            name="TrafficRecorder",
+            daemon=True,
+        )
+        self._writer.start()
+        _LOGGER.info("Capturing %.1f%% of requests to %s", sample_rate * 100, path)
+
+    def should_sample(self) -> bool:
+        """Returns `True` if the next request should be captured."""
+        return random.random() < self._sample_rate
+
+    def record(
+        self,
+        timestamp: float,
+        latency: float,
+        metadata: Iterable[tuple[str, str | bytes]],
+        request: bytes,
+        status: int,
+        response: bytes,
+    ) -> None:
+        """
+        Queues a request to be written to the log.
+
+        This doesn't block. If the writer thread is too far behind, the request
+        is dropped.
+
+        Args:
+            timestamp: Request start time (`time.time()`).
+            latency: Time taken to respond, in seconds.
+            metadata: Invocation metadata for the request.
+            request: Serialized `HttpBody` request.
+            status: HTTP response status.
+            response: Serialized `HttpBody` response.
+        """
+        try:
+            self._queue.put_nowait(
+                (timestamp, latency, metadata, request, status, response)
+            )
+        except queue.Full:
+            _LOGGER.warning("Traffic capture log writer is behind, dropping request")
+
+    def _encode(
+        self,
+        timestamp: float,
+        latency: float,
+        metadata: Iterable[tuple[str, str | bytes]],
+        request: bytes,
+        status: int,
+        response: bytes,
+    ) -> bytes:
+        """Redacts and encodes a request passed to `record()`."""
+        captured_metadata: list[tuple[str, bytes]] = []
+        skip_body = False
+        for k, v in metadata:
+            if k == _PATH_HEADER:
+                path = v if isinstance(v, str) else v.decode("latin1")
+                skip_body = path.partition("?")[0] in self._skip_paths
+            if k in self._redact_headers:
+                v = _REDACTED
+            elif isinstance(v, str):
+                v = v.encode("latin1")
+            captured_metadata.append((k, v))
+
+        if skip_body:
+            # Keep the content type, so the request can still be replayed.
+            body = httpbody_pb2.HttpBody.FromString(request)
+            body.ClearField("data")
+            request = body.SerializeToString()
+
+        return encode_record(
+            Record(
+                timestamp=timestamp,
+                latency=latency,
+                status=status,
+                response_length=len(response),
+                response_digest=digest_response(response),
+                metadata=captured_metadata,
+                request=request,
+            )
+        )
+
+    def _write_records(self) -> None:
+        """Writes queued requests to the log, until `close()` is called."""
+        while (capture := self._queue.get()) is not None:
+            try:
+                os.write(self._fd, self._encode(*capture))
+            except Exception:
+                _LOGGER.exception("Unable to write to traffic capture log")
+
+    def close(self) -> None:
+        """Writes any queued requests, and closes the log."""
+        self._queue.put(None)
+        self._writer.join()
+        os.close(self._fd)
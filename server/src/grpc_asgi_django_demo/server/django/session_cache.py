@@ -0,0 +1,323 @@
+"""
+Process-local session and user cache.
+
+Every request goes through `SessionMiddleware` and `AuthenticationMiddleware`,
+which normally load the session and the logged-in user from the database. This
+module keeps recently used (decoded) sessions and users in memory:
+
+* `SessionStore` is a session engine (`SESSION_ENGINE`) based on Django's
+  database engine. Sessions are read from the cache, and updates to existing
+  sessions are written back to the database in the background, coalescing
+  repeated updates to the same session. Creating and deleting sessions (eg:
+  logging in and out), and updates which change who is logged in, still go
+  straight to the database.
+
+* `CachedModelBackend` is an authentication backend (`AUTHENTICATION_BACKENDS`)
+  which caches the users returned by `ModelBackend.get_user()`. A user is
+  evicted whenever it is saved (eg: changing its password) or deleted, and when
+  it logs out.
+
+Invalidation only happens in the process that made the change. Other
+processes sharing the database (including the other generation of worker
+during a reload) keep using their cached copy until it expires, after
+`SESSION_CACHE_TTL` seconds. For example, a session that logged out in one
+process stays logged in for up to that long in another. At most
+`SESSION_CACHE_MAX_ENTRIES` of each are kept, evicting the least recently used.
+
+Pending session updates are written every `SESSION_WRITE_BEHIND_INTERVAL`
+seconds, and when the process exits. Updates are lost if the process crashes.
+
+Django's database engine raises `UpdateError` (which `SessionMiddleware` turns
+into `SessionInterrupted`) when saving a session that was deleted by another
+request. That still happens when the session isn't in this process' cache (eg:
+this process deleted it). Otherwise, by the time a background update is written,
+its response has already been sent, so the update is dropped instead.
+"""
+
+import atexit
+from collections import OrderedDict
+import copy
+from datetime import datetime
+import logging
+import threading
+import time
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.base_user import AbstractBaseUser
+from django.contrib.auth.signals import user_logged_out
+from django.contrib.sessions.backends import db
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.INFO)
+
+_K = TypeVar("_K", bound=Hashable)
+_V = TypeVar("_V")
+
+# Session keys which say who is logged in
+_AUTH_SESSION_KEYS = (SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY)
+
+# Attributes where ModelBackend caches permissions on a user
+_PERMISSION_CACHES = ("_perm_cache", "_user_perm_cache", "_group_perm_cache")
+
+
+class _LRUCache(Generic[_K, _V]):
+    """Thread-safe LRU cache, with a time-to-live for each entry."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: OrderedDict[_K, tuple[float, _V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: _K) -> Optional[_V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: _K, value: _V) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: _K) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class _WriteBehind:
+    """
+    Writes session updates to the database from a background thread.
+    """
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        # session key -> (encoded session data, expiry date)
+        self._pending: dict[str, tuple[str, datetime]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def put(self, session_key: str, session_data: str, expire_date: datetime) -> None:
+        with self._lock:
+            self._pending[session_key] = (session_data, expire_date)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="SessionWriteBehind", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def discard(self, session_key: str) -> None:
+        with self._lock:
+            self._pending.pop(session_key, None)
+
+    def flush(self) -> None:
+        """Writes all pending session updates."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        model = SessionStore.get_model_class()
+        try:
+            deleted = 0
+            for session_key, (session_data, expire_date) in pending.items():
+                # Only update sessions which still exist, so we don't resurrect
+                # one that was deleted since.
+                if not model.objects.filter(session_key=session_key).update(
+                    session_data=session_data, expire_date=expire_date
+                ):
+                    deleted += 1
+            if deleted:
+                _LOGGER.info("Dropped updates to %d deleted sessions", deleted)
+        except Exception:
+            _LOGGER.exception("Unable to write %d sessions", len(pending))
+        finally:
+            connections.close_all()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self._interval)
+            self.flush()
+
+
+_sessions: _LRUCache[str, tuple[datetime, dict[str, Any]]] = _LRUCache(
+    settings.SESSION_CACHE_MAX_ENTRIES, settings.SESSION_CACHE_TTL
+)
+_users: _LRUCache[str, AbstractBaseUser] = _LRUCache(
+    settings.SESSION_CACHE_MAX_ENTRIES, settings.SESSION_CACHE_TTL
+)
+_write_behind = _WriteBehind(settings.SESSION_WRITE_BEHIND_INTERVAL)
+
+
+class SessionStore(db.SessionStore):
+    """
+    Database-backed session store, with a process-local cache.
+    """
+
+    def _load_cached(self) -> Optional[dict[str, Any]]:
+        if not self.session_key:
+            return None
+        entry = _sessions.get(self.session_key)
+        if entry is None:
+            return None
+        expire_date, data = entry
+        if expire_date <= timezone.now():
+            _sessions.pop(self.session_key)
+            return None
+        return copy.deepcopy(data)
+
+    def _cache(self, session_key: str, expire_date: datetime, data: dict[str, Any]):
+        _sessions.set(session_key, (expire_date, copy.deepcopy(data)))
+
+    def load(self):
+        data = self._load_cached()
+        if data is not None:
+            return data
+
+        s = self._get_session_from_db()
+        if s is None:
+            return {}
+        data = self.decode(s.session_data)
+        self._cache(s.session_key, s.expire_date, data)
+        return data
+
+    async def aload(self):
+        data = self._load_cached()
+        if data is not None:
+            return data
+
+        s = await self._aget_session_from_db()
+        if s is None:
+            return {}
+        data = self.decode(s.session_data)
+        self._cache(s.session_key, s.expire_date, data)
+        return data
+
+    def exists(self, session_key):
+        return _sessions.get(session_key) is not None or super().exists(session_key)
+
+    async def aexists(self, session_key):
+        return _sessions.get(session_key) is not None or await super().aexists(
+            session_key
+        )
+
+    def _can_write_behind(self, session_key: str, data: dict[str, Any]) -> bool:
+        """
+        Returns `True` if an update to a session can be written in the
+        background.
+
+        Otherwise, it needs to be written straight to the database, because
+        the session isn't cached (so may have been deleted), or it changes who
+        is logged in.
+        """
+        entry = _sessions.get(session_key)
+        if entry is None:
+            return False
+        cached = entry[1]
+        return all(cached.get(k) == data.get(k) for k in _AUTH_SESSION_KEYS)
+
+    def save(self, must_create=False):
+        if self.session_key is None or must_create:
+            # New sessions need to be written immediately, to ensure the key is
+            # unique.
+            return super().save(must_create=must_create)
+
+        session_key = self.session_key
+        data = self._get_session()
+        expire_date = self.get_expiry_date()
+        if self._can_write_behind(session_key, data):
+            self._cache(session_key, expire_date, data)
+            _write_behind.put(session_key, self.encode(data), expire_date)
+            return
+
+        # Don't let an older pending update overwrite this one.
+        _write_behind.discard(session_key)
+        super().save()
+        self._cache(session_key, expire_date, data)
+
+    async def asave(self, must_create=False):
+        if self.session_key is None or must_create:
+            return await super().asave(must_create=must_create)
+
+        session_key = self.session_key
+        data = await self._aget_session()
+        expire_date = await self.aget_expiry_date()
+        if self._can_write_behind(session_key, data):
+            self._cache(session_key, expire_date, data)
+            _write_behind.put(session_key, self.encode(data), expire_date)
+            return
+
+        _write_behind.discard(session_key)
+        await super().asave()
+        self._cache(session_key, expire_date, data)
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is not None:
+            _sessions.pop(session_key)
+            _write_behind.discard(session_key)
+        super().delete(session_key)
+
+    async def adelete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is not None:
+            _sessions.pop(session_key)
+            _write_behind.discard(session_key)
+        await super().adelete(session_key)
+
+
+def _copy_user(user: AbstractBaseUser) -> AbstractBaseUser:
+    # Give each request its own copy, and don't share cached permissions.
+    user = copy.copy(user)
+    for attr in _PERMISSION_CACHES:
+        user.__dict__.pop(attr, None)
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    `ModelBackend` with a process-local cache of users.
+    """
+
+    def get_user(self, user_id):
+        user = _users.get(str(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            _users.set(str(user_id), user)
+        return _copy_user(user)
+
+    async def aget_user(self, user_id):
+        user = _users.get(str(user_id))
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is None:
+                return None
+            _users.set(str(user_id), user)
+        return _copy_user(user)
+
+
+def _invalidate_user(sender, instance=None, user=None, **kwargs):
+    user = user or instance
+    if isinstance(user, AbstractBaseUser) and user.pk is not None:
+        _users.pop(str(user.pk))
+
+
+post_save.connect(_invalidate_user, dispatch_uid="session_cache_user_saved")
+post_delete.connect(_invalidate_user, dispatch_uid="session_cache_user_deleted")
+user_logged_out.connect(_invalidate_user, dispatch_uid="session_cache_logged_out")
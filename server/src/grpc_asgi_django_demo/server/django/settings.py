@@ -12,8 +12,9 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 # TODO: Integrate existing pydantic-settings with Django settings
 
+import os
 from pathlib import Path
-from ..util import LazyEnv, LazyRequireEnv, get_env_or_secret
+from ..util import LazyEnv, LazyRequireEnv, get_env_or_secret, on_secret_change
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -26,6 +27,23 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = LazyRequireEnv("SECRET_KEY")
 
+# When the SECRET_KEY secret is rotated, the previous key is kept here, so that
+# existing sessions (and other signed data) stay valid. This is only kept in
+# memory, so restarting the server forgets it.
+SECRET_KEY_FALLBACKS: list[str] = []
+_current_secret_key = get_env_or_secret("SECRET_KEY")
+
+
+def _rotate_secret_key(key: str, value: str | None) -> None:
+    global _current_secret_key
+    previous, _current_secret_key = _current_secret_key, value or _current_secret_key
+    if previous and previous != _current_secret_key:
+        # Django reads this list on each use, so update it in place.
+        SECRET_KEY_FALLBACKS[:] = [previous]
+
+
+on_secret_change("SECRET_KEY", _rotate_secret_key)
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
@@ -88,6 +106,41 @@ DATABASES = {
     },
 }
 
+
+def _update_sqlite_db(key: str, value: str | None) -> None:
+    # Connections are closed at the end of each request, so the next one will
+    # open the new database.
+    if value:
+        DATABASES["default"]["NAME"] = value
+
+
+on_secret_change("SQLITE_DB", _update_sqlite_db)
+
+
+# Sessions and authentication, with a process-local cache
+# See grpc_asgi_django_demo.server.django.session_cache
+
+SESSION_ENGINE = "grpc_asgi_django_demo.server.django.session_cache"
+
+AUTHENTICATION_BACKENDS = [
+    "grpc_asgi_django_demo.server.django.session_cache.CachedModelBackend",
+    # Sessions from before CachedModelBackend was added name this backend, and
+    # are logged out if it isn't listed. New logins use the first backend.
+    "django.contrib.auth.backends.ModelBackend",
+]
+
+# How long to cache sessions and users for, in seconds.
+#
+# Caches are only invalidated in the process that made a change, so other
+# processes (including the old and new workers during a reload) can use a stale
+# session or user for up to this long, eg: staying logged in after logging out
+# elsewhere, or after a password change.
+SESSION_CACHE_TTL = 5.0
+# Maximum number of sessions and users to cache
+SESSION_CACHE_MAX_ENTRIES = 10000
+# How often to write session updates to the database, in seconds
+SESSION_WRITE_BEHIND_INTERVAL = 1.0
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -132,6 +185,87 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 GRPC_BIND_ADDR = LazyEnv("BIND_ADDR", "localhost:8081")
 
+# How often to poll /run/secrets for rotated secrets. This also runs alongside
+# inotify, which doesn't see changes to individually bind-mounted secret files.
+SECRETS_POLL_INTERVAL = 10.0
+
+# How long to report NOT_SERVING before shutting down, so Envoy's health checks
+# (see envoy/envoy.yaml) notice and stop sending us traffic
+GRPC_DRAIN_DELAY = 35.0
+
+# How long to wait for in-flight requests to finish when shutting down
+GRPC_SHUTDOWN_GRACE = 30.0
+
+# Experimental: run the ASGI application in a pool of "threads" or
+# "interpreters", see grpc_asgi_django_demo.server.asgi_pool. If unset, it runs
+# on the gRPC server's event loop.
+ASGI_WORKER_MODE = get_env_or_secret("ASGI_WORKER_MODE")
+ASGI_WORKERS = os.cpu_count() or 1
+
+# Traffic capture for AsgiService.Handler, see
+# grpc_asgi_django_demo.server.capture. Disabled unless TRAFFIC_CAPTURE_PATH is
+# set.
+TRAFFIC_CAPTURE_PATH = get_env_or_secret("TRAFFIC_CAPTURE_PATH")
+# Proportion of requests to capture
+TRAFFIC_CAPTURE_SAMPLE_RATE = 0.01
+# Headers to redact from captured requests
+TRAFFIC_CAPTURE_REDACT_HEADERS = [
+    "authorization",
+    "cookie",
+    "proxy-authorization",
+    "x-csrftoken",
+]
+# Paths whose request bodies are left out of captured requests, because they
+# contain passwords. Other request bodies are captured as-is, so add any other
+# views which handle secrets here.
+TRAFFIC_CAPTURE_SKIP_PATHS = [
+    "/admin/login/",
+    "/admin/password_change/",
+]
+
+# Event loop lag watchdog, see grpc_asgi_django_demo.server.watchdog
+# How often to measure event loop lag, in seconds
+LOOP_WATCHDOG_INTERVAL = 0.1
+# Log a stack trace when the event loop is blocked for this many seconds
+LOOP_WATCHDOG_SLOW_CALLBACK = 0.25
+# Report AsgiService as NOT_SERVING when lag is over LOOP_WATCHDOG_UNHEALTHY_LAG
+# seconds for LOOP_WATCHDOG_UNHEALTHY_PERIOD seconds, and SERVING again when it
+# has been under that for LOOP_WATCHDOG_RECOVERY_PERIOD seconds
+LOOP_WATCHDOG_UNHEALTHY_LAG = 0.5
+LOOP_WATCHDOG_UNHEALTHY_PERIOD = 5.0
+LOOP_WATCHDOG_RECOVERY_PERIOD = 10.0
+# How often to log event loop lag percentiles, in seconds
+LOOP_WATCHDOG_REPORT_INTERVAL = 60.0
+
+# gRPC server interceptors, outermost first.
+# See grpc_asgi_django_demo.server.interceptors
+GRPC_SERVER_INTERCEPTORS = [
+    "grpc_asgi_django_demo.server.interceptors.LatencyInterceptor",
+    "grpc_asgi_django_demo.server.interceptors.ConcurrencyLimitInterceptor",
+    "grpc_asgi_django_demo.server.interceptors.UnaryCacheInterceptor",
+]
+
+# Log calls slower than this many seconds
+GRPC_SLOW_CALL_THRESHOLD = 1.0
+
+# Maximum in-flight calls per method
+GRPC_CONCURRENCY_LIMITS = {
+    "/grpc_asgi_django_demo.proto.v1.AsgiService/Handler": 100,
+}
+
+# Response cache lifetime (in seconds) per method
+GRPC_UNARY_CACHE_TTL = {
+    "/grpc_asgi_django_demo.proto.v1.DemoService/Add": 60,
+}
+GRPC_UNARY_CACHE_MAX_ENTRIES = 1024
+
+# Per-route memory profiling, reported by AdminService.MemoryReport. See
+# grpc_asgi_django_demo.server.memory_profile. This slows down the server, and
+# is disabled unless MEMORY_PROFILING is set to a non-empty value.
+MEMORY_PROFILING = bool(get_env_or_secret("MEMORY_PROFILING"))
+# Number of stack frames to keep for each traced allocation
+MEMORY_PROFILING_FRAMES = 1
+
 
 def disable_runserver():
     # HACK: disables manage.py runserver
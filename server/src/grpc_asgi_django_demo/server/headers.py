@@ -0,0 +1,166 @@
+"""
+Translates ASGI response headers into gRPC response metadata.
+
+gRPC metadata is stricter than HTTP headers:
+
+* keys must be lowercase, and only contain `0-9 a-z _ - .`
+* keys starting with `grpc-` are reserved for gRPC itself
+* values of keys without a `-bin` suffix must be printable ASCII
+
+So this:
+
+* lowercases header names (Django doesn't), using a precomputed table of common
+  header names so that most don't need to be decoded and lowercased
+* strips hop-by-hop headers (which are meaningless over gRPC), and headers which
+  aren't valid gRPC metadata keys
+* passes headers with non-ASCII values as binary (`-bin`) metadata
+* pulls out `content-type`, which goes in the `HttpBody` instead
+* passes the HTTP status in the `x-http-code` header, from a table of
+  precomputed values
+"""
+
+import logging
+import re
+import sys
+from typing import Iterable, Optional
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.INFO)
+
+STATUS_HEADER = "x-http-code"
+
+# Header names that Django (and its contrib apps) commonly send.
+_COMMON_HEADER_NAMES = (
+    "Accept-Ranges",
+    "Access-Control-Allow-Origin",
+    "Age",
+    "Allow",
+    "Cache-Control",
+    "Content-Disposition",
+    "Content-Encoding",
+    "Content-Language",
+    "Content-Length",
+    "Content-Security-Policy",
+    "Content-Type",
+    "Cross-Origin-Opener-Policy",
+    "ETag",
+    "Expires",
+    "Last-Modified",
+    "Link",
+    "Location",
+    "Referrer-Policy",
+    "Retry-After",
+    "Set-Cookie",
+    "Strict-Transport-Security",
+    "Vary",
+    "WWW-Authenticate",
+    "X-Content-Type-Options",
+    "X-Frame-Options",
+)
+
+# Hop-by-hop headers, which only apply to a single HTTP/1.1 connection.
+# https://www.rfc-editor.org/rfc/rfc9110#section-7.6.1
+_HOP_BY_HOP_HEADERS = frozenset(
+    (
+        "connection",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "proxy-connection",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+    )
+)
+
+_CONTENT_TYPE = sys.intern("content-type")
+
+# Marks a header which is dropped.
+_DROP = ""
+
+# header name -> metadata key (or `_DROP`)
+_NAMES: dict[bytes, str] = {}
+for _name in _COMMON_HEADER_NAMES:
+    _key = sys.intern(_name.lower())
+    for _variant in (_name, _key, _name.title()):
+        _NAMES[_variant.encode("latin1")] = _key
+for _key in _HOP_BY_HOP_HEADERS:
+    _NAMES[_key.encode("latin1")] = _DROP
+    _NAMES[_key.title().encode("latin1")] = _DROP
+
+# Number of entries in `_NAMES` after which we stop caching unknown names.
+_MAX_NAMES = len(_NAMES) + 1024
+
+# status -> `x-http-code` metadata
+_STATUSES: dict[int, tuple[str, bytes]] = {
+    status: (STATUS_HEADER, str(status).encode("latin1")) for status in range(100, 600)
+}
+
+# content-type value -> str
+_CONTENT_TYPES: dict[bytes, str] = {}
+_MAX_CONTENT_TYPES = 64
+
+_VALID_KEY = re.compile(r"[0-9a-z_.\-]+")
+# Bytes allowed in non-binary metadata values
+_PRINTABLE = bytes(range(0x20, 0x7F))
+
+
+def _metadata_key(name: bytes) -> str:
+    """Converts a header name into a metadata key, or `_DROP`."""
+    key = name.decode("latin1").lower()
+    if key in _HOP_BY_HOP_HEADERS or key.startswith("grpc-"):
+        key = _DROP
+    elif not _VALID_KEY.fullmatch(key):
+        _LOGGER.debug("Dropping invalid header name: %r", name)
+        key = _DROP
+    else:
+        key = sys.intern(key)
+
+    if len(_NAMES) < _MAX_NAMES:
+        _NAMES[name] = key
+    return key
+
+
+def status_metadata(status: int) -> tuple[str, bytes]:
+    """Returns the `x-http-code` metadata for a HTTP status."""
+    return _STATUSES.get(status) or (STATUS_HEADER, str(status).encode("latin1"))
+
+
+def translate_response_headers(
+    status: int,
+    asgi_headers: Iterable[tuple[bytes, bytes]],
+) -> tuple[list[tuple[str, bytes]], Optional[str]]:
+    """
+    Converts a HTTP status and ASGI response headers into gRPC metadata.
+
+    Returns:
+        gRPC metadata (starting with `x-http-code`), and the value of the
+        `Content-Type` header (if any).
+    """
+    metadata = [status_metadata(status)]
+    content_type: Optional[str] = None
+    names = _NAMES
+
+    for name, value in asgi_headers:
+        key = names.get(name)
+        if key is None:
+            key = _metadata_key(name)
+        if key == _DROP:
+            continue
+
+        if key == _CONTENT_TYPE:
+            content_type = _CONTENT_TYPES.get(value)
+            if content_type is None:
+                content_type = value.decode()
+                if len(_CONTENT_TYPES) < _MAX_CONTENT_TYPES:
+                    _CONTENT_TYPES[value] = content_type
+            continue
+
+        # Deleting all printable bytes leaves any that aren't.
+        if value.translate(None, _PRINTABLE) and not key.endswith("-bin"):
+            # gRPC base64-encodes binary metadata values
+            key += "-bin"
+        metadata.append((key, value))
+
+    return metadata, content_type
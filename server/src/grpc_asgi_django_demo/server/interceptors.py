@@ -0,0 +1,268 @@
+"""
+gRPC server interceptors for cross-cutting features.
+
+Interceptors are configured with the `GRPC_SERVER_INTERCEPTORS` Django setting,
+which works like Django's `MIDDLEWARE` setting: it is a list of dotted import
+paths to `grpc.aio.ServerInterceptor` classes, which are instanciated (without
+arguments) once at server start-up time.
+
+Interceptors in this module only wrap the methods they are configured for. All
+other methods get their original `RpcMethodHandler` passed through as-is, so an
+interceptor which doesn't apply to a method adds no per-call allocations.
+
+Wrapped handlers are built once per method and then re-used for every call.
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+import grpc
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.INFO)
+
+_Continuation = Callable[
+    [grpc.HandlerCallDetails], Awaitable[Optional[grpc.RpcMethodHandler]]
+]
+_UnaryBehaviour = Callable[[Any, grpc.aio.ServicerContext], Awaitable[Any]]
+
+
+def load_interceptors() -> list[grpc.aio.ServerInterceptor]:
+    """
+    Instanciates all interceptors listed in the `GRPC_SERVER_INTERCEPTORS`
+    Django setting, in order.
+    """
+    paths: list[str] = getattr(settings, "GRPC_SERVER_INTERCEPTORS", [])
+    return [import_string(path)() for path in paths]
+
+
+class _MethodInterceptor(grpc.aio.ServerInterceptor, ABC):
+    """
+    Base class for interceptors which wrap unary-unary methods.
+
+    Subclasses implement `applies_to()` to select methods, and `wrap()` to build
+    a replacement handler for a method.
+    """
+
+    def __init__(self):
+        # method name -> (original handler, wrapped handler)
+        self._handlers: dict[
+            str, tuple[grpc.RpcMethodHandler, grpc.RpcMethodHandler]
+        ] = {}
+
+    @abstractmethod
+    def applies_to(self, method: str) -> bool:
+        """Returns `True` if this interceptor should wrap `method`."""
+
+    @abstractmethod
+    def wrap(
+        self, method: str, handler: grpc.RpcMethodHandler
+    ) -> grpc.RpcMethodHandler:
+        """Builds a wrapped version of a unary-unary `handler` for `method`."""
+
+    async def intercept_service(
+        self,
+        continuation: _Continuation,
+        handler_call_details: grpc.HandlerCallDetails,
+    ) -> Optional[grpc.RpcMethodHandler]:
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+
+        method = handler_call_details.method
+        cached = self._handlers.get(method)
+        if cached is not None and cached[0] is handler:
+            return cached[1]
+
+        if (
+            handler.request_streaming
+            or handler.response_streaming
+            or handler.unary_unary is None
+            or not self.applies_to(method)
+        ):
+            # Remember that we're passing this through, so we don't need to
+            # check again.
+            self._handlers[method] = (handler, handler)
+            return handler
+
+        wrapped = self.wrap(method, handler)
+        self._handlers[method] = (handler, wrapped)
+        return wrapped
+
+
+@dataclass(slots=True)
+class LatencyStats:
+    """Latency statistics for a single gRPC method."""
+
+    count: int = 0
+    errors: int = 0
+    total_ns: int = 0
+    max_ns: int = 0
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.count if self.count else 0.0
+
+
+class LatencyInterceptor(_MethodInterceptor):
+    """
+    Measures the latency of unary-unary gRPC methods.
+
+    Statistics are kept per-method in `LatencyInterceptor.stats`, and reported
+    by `AdminService.CallLatency`. Calls which take longer than the
+    `GRPC_SLOW_CALL_THRESHOLD` setting (in seconds) are logged as a warning.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stats: dict[str, LatencyStats] = {}
+        self._slow_ns = int(
+            getattr(settings, "GRPC_SLOW_CALL_THRESHOLD", 1.0) * 1_000_000_000
+        )
+
+    def applies_to(self, method: str) -> bool:
+        return True
+
+    def wrap(
+        self, method: str, handler: grpc.RpcMethodHandler
+    ) -> grpc.RpcMethodHandler:
+        inner: _UnaryBehaviour = handler.unary_unary
+        stats = self.stats.setdefault(method, LatencyStats())
+        slow_ns = self._slow_ns
+
+        async def behaviour(request: Any, context: grpc.aio.ServicerContext) -> Any:
+            start = time.perf_counter_ns()
+            try:
+                return await inner(request, context)
+            except BaseException:
+                stats.errors += 1
+                raise
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                stats.count += 1
+                stats.total_ns += elapsed
+                if elapsed > stats.max_ns:
+                    stats.max_ns = elapsed
+                if elapsed > slow_ns:
+                    _LOGGER.warning(
+                        "Slow call to %s: %.3f ms", method, elapsed / 1_000_000
+                    )
+
+        return grpc.unary_unary_rpc_method_handler(
+            behaviour,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
+
+
+class ConcurrencyLimitInterceptor(_MethodInterceptor):
+    """
+    Limits the number of concurrent calls to unary-unary gRPC methods.
+
+    Limits are configured with the `GRPC_CONCURRENCY_LIMITS` setting, which maps
+    full method names (eg: `/package.Service/Method`) to the maximum number of
+    in-flight calls.
+
+    Calls which exceed the limit are rejected immediately with
+    `RESOURCE_EXHAUSTED`, rather than being queued, so that Envoy can retry
+    them elsewhere.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._limits: dict[str, int] = getattr(settings, "GRPC_CONCURRENCY_LIMITS", {})
+
+    def applies_to(self, method: str) -> bool:
+        return method in self._limits
+
+    def wrap(
+        self, method: str, handler: grpc.RpcMethodHandler
+    ) -> grpc.RpcMethodHandler:
+        inner: _UnaryBehaviour = handler.unary_unary
+        limit = self._limits[method]
+        in_flight = 0
+
+        async def behaviour(request: Any, context: grpc.aio.ServicerContext) -> Any:
+            nonlocal in_flight
+            if in_flight >= limit:
+                return await context.abort(
+                    grpc.StatusCode.RESOURCE_EXHAUSTED,
+                    "too many concurrent requests",
+                )
+
+            in_flight += 1
+            try:
+                return await inner(request, context)
+            finally:
+                in_flight -= 1
+
+        return grpc.unary_unary_rpc_method_handler(
+            behaviour,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
+
+
+class UnaryCacheInterceptor(_MethodInterceptor):
+    """
+    Caches responses of unary-unary gRPC methods, keyed on the serialized
+    request.
+
+    Cached methods are configured with the `GRPC_UNARY_CACHE_TTL` setting, which
+    maps full method names (eg: `/package.Service/Method`) to a cache lifetime
+    in seconds. Each method keeps at most `GRPC_UNARY_CACHE_MAX_ENTRIES`
+    responses (default: 1024), evicting the least recently used.
+
+    Responses are cached in their serialized form, so cache hits skip both
+    request deserialization and response serialization.
+
+    **Warning:** only use this with methods whose response depends solely on
+    the request message (not on invocation metadata or the peer). This makes it
+    unsuitable for `AsgiService.Handler`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._ttls: dict[str, float] = getattr(settings, "GRPC_UNARY_CACHE_TTL", {})
+        self._max_entries: int = getattr(settings, "GRPC_UNARY_CACHE_MAX_ENTRIES", 1024)
+
+    def applies_to(self, method: str) -> bool:
+        return method in self._ttls
+
+    def wrap(
+        self, method: str, handler: grpc.RpcMethodHandler
+    ) -> grpc.RpcMethodHandler:
+        inner: _UnaryBehaviour = handler.unary_unary
+        deserialize = handler.request_deserializer
+        serialize = handler.response_serializer
+        ttl = self._ttls[method]
+        max_entries = self._max_entries
+        # serialized request -> (expiry time, serialized response)
+        cache: OrderedDict[bytes, tuple[float, bytes]] = OrderedDict()
+
+        async def behaviour(request: bytes, context: grpc.aio.ServicerContext) -> bytes:
+            now = time.monotonic()
+            hit = cache.get(request)
+            if hit is not None:
+                if hit[0] > now:
+                    cache.move_to_end(request)
+                    return hit[1]
+                del cache[request]
+
+            response = await inner(
+                deserialize(request) if deserialize else request, context
+            )
+            data: bytes = serialize(response) if serialize else response
+            cache[request] = (now + ttl, data)
+            if len(cache) > max_entries:
+                cache.popitem(last=False)
+            return data
+
+        # Pass raw bytes in and out of the wrapped behaviour.
+        return grpc.unary_unary_rpc_method_handler(behaviour)
@@ -0,0 +1,164 @@
+"""
+Per-route memory profiling, using `tracemalloc`.
+
+When enabled (`MEMORY_PROFILING`), `AsgiService.Handler` records for each
+Django route (resolved from the request path):
+
+* the change in traced memory over each request
+* the request and response body bytes buffered for each request
+
+`AdminService.MemoryReport` reports these, along with the allocation sites with
+the most memory, and those which changed the most since the previous report.
+
+Limitations:
+
+* Tracing every allocation makes the server much slower, and uses more memory.
+* Memory changes for a request also count allocations made by anything else
+  running at the same time, so are only approximate on a busy server.
+* Allocations made in `interpreters` mode ASGI workers aren't traced.
+"""
+
+from dataclasses import dataclass
+import logging
+import tracemalloc
+from typing import Optional
+
+from django.urls import Resolver404, resolve
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.INFO)
+
+UNRESOLVED_ROUTE = "<unresolved>"
+
+# Don't report allocations made by tracemalloc or the import system.
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+@dataclass(slots=True)
+class RouteStats:
+    requests: int = 0
+    net_bytes: int = 0
+    """Total change in traced memory over each request."""
+    peak_request_bytes: int = 0
+    """Largest change in traced memory over a single request."""
+    peak_buffered_bytes: int = 0
+    """Largest request and response bodies buffered by a single request."""
+
+
+@dataclass(slots=True)
+class SnapshotReport:
+    traced_bytes: int
+    peak_traced_bytes: int
+    top_allocations: list[tracemalloc.Statistic]
+    growth: list[tracemalloc.StatisticDiff]
+    """Empty for the first snapshot."""
+
+
+def route_for_path(path: str) -> str:
+    """Returns the Django URL pattern which handles `path`."""
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return UNRESOLVED_ROUTE
+    return match.route or match.view_name
+
+
+class RequestProfile:
+    """Memory profile of a single request, from `MemoryProfiler.request()`."""
+
+    __slots__ = ("_profiler", "_path", "_start_bytes")
+
+    def __init__(self, profiler: "MemoryProfiler", path: str):
+        self._profiler = profiler
+        self._path = path
+        self._start_bytes = tracemalloc.get_traced_memory()[0]
+
+    def finish(self, buffered_bytes: int) -> None:
+        """
+        Records the request's memory usage.
+
+        Args:
+            buffered_bytes: Size of the request and response bodies buffered
+                for the request.
+        """
+        delta = tracemalloc.get_traced_memory()[0] - self._start_bytes
+        self._profiler._record(self._path, delta, buffered_bytes)
+
+
+class MemoryProfiler:
+    """
+    Traces memory allocations, and attributes them to Django routes.
+    """
+
+    def __init__(self, frames: int):
+        """
+        Starts tracing memory allocations.
+
+        Args:
+            frames: Number of stack frames to keep for each allocation.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._routes: dict[str, RouteStats] = {}
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        _LOGGER.warning("Memory profiling is enabled, this slows down the server")
+
+    def request(self, path: str) -> RequestProfile:
+        """Starts profiling a request for `path`."""
+        return RequestProfile(self, path)
+
+    def _record(self, path: str, delta: int, buffered_bytes: int) -> None:
+        route = route_for_path(path)
+        stats = self._routes.get(route)
+        if stats is None:
+            stats = self._routes[route] = RouteStats()
+        stats.requests += 1
+        stats.net_bytes += delta
+        stats.peak_request_bytes = max(stats.peak_request_bytes, delta)
+        stats.peak_buffered_bytes = max(stats.peak_buffered_bytes, buffered_bytes)
+
+    def routes(self, reset: bool = False) -> dict[str, RouteStats]:
+        """
+        Returns memory statistics for each route.
+
+        Args:
+            reset: Clear the statistics afterwards.
+        """
+        routes = self._routes
+        if reset:
+            self._routes = {}
+        else:
+            routes = dict(routes)
+        return routes
+
+    def snapshot(self, limit: int) -> SnapshotReport:
+        """
+        Takes a snapshot of traced memory, and compares it with the previous
+        snapshot.
+
+        This is slow with many traced allocations, and keeps the snapshot in
+        memory until the next call.
+
+        Args:
+            limit: Maximum number of allocation sites to report.
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        traced_bytes, peak_traced_bytes = tracemalloc.get_traced_memory()
+        top_allocations = snapshot.statistics("lineno")[:limit]
+
+        growth: list[tracemalloc.StatisticDiff] = []
+        if self._previous is not None:
+            growth = snapshot.compare_to(self._previous, "lineno")[:limit]
+        self._previous = snapshot
+
+        return SnapshotReport(
+            traced_bytes=traced_bytes,
+            peak_traced_bytes=peak_traced_bytes,
+            top_allocations=top_allocations,
+            growth=growth,
+        )
@@ -0,0 +1,282 @@
+"""
+Replays a traffic capture log against a gRPC ASGI Django demo server.
+
+Requests are sent to `AsgiService.Handler` either at their original timing
+(optionally sped up), or as fast as possible. This reports the latency
+distribution of the replayed requests, and any responses which differ from the
+originals.
+
+With `--memory-report`, this also reports the server's memory growth over the
+replay, from `AdminService.MemoryReport` (which needs the server to be started
+with `MEMORY_PROFILING` set).
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+from dataclasses import dataclass
+import logging
+import time
+from typing import Optional, Sequence
+
+from google.api import httpbody_pb2
+import grpc
+
+from grpc_asgi_django_demo.proto.v1 import service_pb2, service_pb2_grpc
+from .capture import Record, digest_response, read_records
+
+
+def _is_replayable_header(key: str) -> bool:
+    # These are set by the gRPC client library itself.
+    return not (
+        key.startswith(":")
+        or key.startswith("grpc-")
+        or key in ("content-type", "te", "user-agent")
+    )
+
+
+def _record_path(record: Record) -> str:
+    for k, v in record.metadata:
+        if k == "x-envoy-original-path":
+            return v.decode("latin1")
+    return "?"
+
+
+@dataclass(slots=True)
+class Result:
+    record: Record
+    latency: float
+    status: Optional[int] = None
+    """HTTP response status, or `None` if the RPC failed."""
+    error: Optional[grpc.StatusCode] = None
+    body_matches: bool = False
+
+
+async def _replay_one(stub: service_pb2_grpc.AsgiServiceStub, record: Record) -> Result:
+    metadata = tuple(
+        (k, v if k.endswith("-bin") else v.decode("latin1"))
+        for k, v in record.metadata
+        if _is_replayable_header(k)
+    )
+    request = httpbody_pb2.HttpBody.FromString(record.request)
+
+    start = time.perf_counter()
+    call = stub.Handler(request, metadata=metadata)
+    try:
+        response = await call
+    except grpc.aio.AioRpcError as e:
+        return Result(record, time.perf_counter() - start, error=e.code())
+    latency = time.perf_counter() - start
+
+    status = None
+    for k, v in await call.initial_metadata() or ():
+        if k == "x-http-code":
+            status = int(v)
+    return Result(
+        record,
+        latency,
+        status=status,
+        body_matches=digest_response(response.SerializeToString())
+        == record.response_digest,
+    )
+
+
+async def replay(
+    records: Sequence[Record],
+    target: str,
+    speed: Optional[float],
+    concurrency: int,
+) -> list[Result]:
+    """
+    Replays `records` (sorted by `timestamp`) against the server at `target`.
+
+    Args:
+        speed: Replay at this multiple of the original timing, or `None` to
+            replay as fast as possible.
+        concurrency: Maximum number of in-flight requests when replaying as
+            fast as possible.
+    """
+    async with grpc.aio.insecure_channel(target) as channel:
+        stub = service_pb2_grpc.AsgiServiceStub(channel)
+
+        if speed is None:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def limited(record: Record) -> Result:
+                async with semaphore:
+                    return await _replay_one(stub, record)
+
+            return await asyncio.gather(*(limited(r) for r in records))
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        first = records[0].timestamp if records else 0.0
+        tasks: list[asyncio.Task[Result]] = []
+        for record in records:
+            delay = start + (record.timestamp - first) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(_replay_one(stub, record)))
+        return await asyncio.gather(*tasks)
+
+
+def _percentiles(values: list[float]) -> str:
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    n = len(values) - 1
+    return ", ".join(
+        f"{name}={values[n * p // 100] * 1000:.1f}ms"
+        for name, p in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+    )
+
+
+def report(results: list[Result], elapsed: float, show_diffs: int) -> None:
+    """Prints a summary of replay `results`."""
+    print(f"Replayed {len(results)} requests in {elapsed:.2f} seconds")
+    if elapsed > 0:
+        print(f"Throughput: {len(results) / elapsed:.1f} requests/second")
+    print("Original latency:", _percentiles([r.record.latency for r in results]))
+    print("Replay latency:  ", _percentiles([r.latency for r in results]))
+
+    errors = Counter(r.error.name for r in results if r.error is not None)
+    for code, count in errors.most_common():
+        print(f"RPC errors ({code}): {count}")
+
+    status_diffs = [
+        r for r in results if r.error is None and r.status != r.record.status
+    ]
+    body_diffs = [
+        r
+        for r in results
+        if r.error is None and r.status == r.record.status and not r.body_matches
+    ]
+    print(f"Status differences: {len(status_diffs)}")
+    print(f"Body differences: {len(body_diffs)}")
+
+    for r in status_diffs[:show_diffs]:
+        print(f"  status {r.record.status} -> {r.status}: {_record_path(r.record)}")
+    for r in body_diffs[:show_diffs]:
+        print(f"  body differs ({r.status}): {_record_path(r.record)}")
+
+
+async def memory_report(
+    target: str, reset_routes: bool
+) -> service_pb2.MemoryReportResponse:
+    """Fetches a memory report from the server at `target`."""
+    async with grpc.aio.insecure_channel(target) as channel:
+        stub = service_pb2_grpc.AdminServiceStub(channel)
+        return await stub.MemoryReport(
+            service_pb2.MemoryReportRequest(reset_routes=reset_routes)
+        )
+
+
+def _kib(size: int) -> str:
+    return f"{size / 1024:+.1f} KiB"
+
+
+def print_memory_report(
+    before: service_pb2.MemoryReportResponse,
+    after: service_pb2.MemoryReportResponse,
+) -> None:
+    """Prints the server's memory growth between two memory reports."""
+    print(
+        f"Server traced memory: {_kib(after.traced_bytes - before.traced_bytes)}",
+        f"(now {after.traced_bytes / 1024:.1f} KiB,",
+        f"peak {after.peak_traced_bytes / 1024:.1f} KiB)",
+    )
+    print("Largest changes:")
+    for site in after.growth:
+        print(
+            f"  {_kib(site.size_diff_bytes)} ({site.count_diff:+d} blocks):",
+            f"{site.filename}:{site.lineno}",
+        )
+    print("Memory per route:")
+    for route in after.routes:
+        print(
+            f"  {route.route}: {route.requests} requests,",
+            f"net {_kib(route.net_bytes)},",
+            f"peak request {_kib(route.peak_request_bytes)},",
+            f"peak buffered {route.peak_buffered_bytes / 1024:.1f} KiB",
+        )
+
+
+def _positive_float(value: str) -> float:
+    try:
+        speed = float(value)
+    except ValueError:
+        speed = None
+    if speed is None or not speed > 0:
+        raise argparse.ArgumentTypeError(f"must be a number above 0: {value!r}")
+    return speed
+
+
+def main():
+    """Main entrypoint."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("log", help="Traffic capture log to replay")
+    parser.add_argument(
+        "--target",
+        default="localhost:8081",
+        help="gRPC server address (default: %(default)s)",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--speed",
+        type=_positive_float,
+        default=1.0,
+        help="Replay at this multiple of the original timing (default: %(default)s)",
+    )
+    mode.add_argument(
+        "--max",
+        action="store_true",
+        help="Replay as fast as possible",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Maximum in-flight requests with --max (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--show-diffs",
+        type=int,
+        default=10,
+        help="Number of differing responses to list (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--memory-report",
+        action="store_true",
+        help="Report the server's memory growth (needs MEMORY_PROFILING)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.log, "rb") as f:
+        records = list(read_records(f))
+    # Requests are logged when they finish, possibly by several processes, so
+    # put them back in the order they started.
+    records.sort(key=lambda r: r.timestamp)
+
+    if args.memory_report:
+        before = asyncio.run(memory_report(args.target, reset_routes=True))
+
+    start = time.perf_counter()
+    results = asyncio.run(
+        replay(
+            records,
+            args.target,
+            speed=None if args.max else args.speed,
+            concurrency=args.concurrency,
+        )
+    )
+    report(results, time.perf_counter() - start, args.show_diffs)
+
+    if args.memory_report:
+        after = asyncio.run(memory_report(args.target, reset_routes=False))
+        print_memory_report(before, after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+In-memory store for Docker secrets, with live reloading.
+
+The secrets directory (`/run/secrets`) is scanned once, on first use, and
+lookups are then served from memory. `SecretStore.watch()` watches the directory
+for changes, and reloads it when a secret is rotated. It uses inotify where
+available, and always polls as well: inotify on the directory doesn't see
+changes to secret files which are bind-mounted individually (as Docker Compose
+does).
+
+Reloads replace the whole set of secrets at once, so readers never see a mix of
+old and new values. Subscribers are notified of each secret that changed.
+
+A secret which disappears or becomes empty keeps its last value (with a
+warning), as this is normally a rotation in progress, rather than something the
+server can run without.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import inspect
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Optional, TypeVar
+import weakref
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.INFO)
+
+_T = TypeVar("_T")
+
+_SECRET_ROOT = Path("/run/secrets")
+_MAX_ENVIRONMENT_LENGTH = 64 << 10  # is enough for anyone
+
+# Delay between an inotify event and reloading, so that a burst of changes (eg:
+# an atomic symlink swap) is handled as a single reload.
+_INOTIFY_DEBOUNCE = 0.1
+
+# <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+
+SecretCallback = Callable[[str, Optional[str]], None]
+
+
+def _inotify_init(path: Path) -> Optional[int]:
+    """
+    Sets up an inotify watch on `path`.
+
+    Returns:
+        A non-blocking inotify file descriptor, or `None` if inotify is not
+        available.
+    """
+    libc_name = ctypes.util.find_library("c")
+    if not libc_name:
+        return None
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    if inotify_add_watch(fd, os.fsencode(path), _IN_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class SecretStore:
+    """
+    In-memory copy of a secrets directory.
+    """
+
+    def __init__(self, root: Path = _SECRET_ROOT):
+        """
+        Args:
+            root: Directory containing secrets, one per file.
+        """
+        self._root = root
+        self._values: Optional[dict[str, str]] = None
+        self._subscribers: dict[str, list[Callable[[], Optional[SecretCallback]]]] = {}
+
+    def _scan(self) -> dict[str, str]:
+        values: dict[str, str] = {}
+        try:
+            entries = list(os.scandir(self._root))
+        except OSError:
+            return values
+
+        for entry in entries:
+            # Skip hidden files, including Kubernetes' `..data` links.
+            if entry.name.startswith("."):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                with open(entry.path, "r") as f:
+                    values[entry.name] = f.read(_MAX_ENVIRONMENT_LENGTH)
+            except OSError:
+                # Silently ignore errors, we can rethrow later.
+                continue
+        return values
+
+    def get(self, key: str, default: _T = None) -> str | _T:
+        """
+        Gets the secret `key`, or `default` if it is not set.
+
+        The secrets directory is scanned on the first call.
+        """
+        values = self._values
+        if values is None:
+            values = self._values = self._scan()
+        return values.get(key, default)
+
+    def reload(self) -> set[str]:
+        """
+        Re-scans the secrets directory, and notifies subscribers of any changes.
+
+        Returns:
+            The names of secrets which changed.
+        """
+        old = self._values or {}
+        new = self._scan()
+        for key, value in old.items():
+            if value and not new.get(key):
+                _LOGGER.warning(
+                    "Secret %r is %s, keeping its previous value",
+                    key,
+                    "empty" if key in new else "missing",
+                )
+                new[key] = value
+        self._values = new
+
+        changed = {k for k in old.keys() | new.keys() if old.get(k) != new.get(k)}
+        for key in changed:
+            _LOGGER.info("Secret %r changed", key)
+            self._notify(key, new.get(key))
+        return changed
+
+    def subscribe(self, key: str, callback: SecretCallback) -> None:
+        """
+        Calls `callback(key, value)` whenever the secret `key` changes.
+
+        `value` is `None` if the secret was removed. Secrets which had a value
+        keep it when they're removed or emptied, so this only happens for
+        secrets which were already empty.
+
+        Bound methods are held with a weak reference, so subscribing doesn't
+        keep their instance alive.
+        """
+        ref: Callable[[], Optional[SecretCallback]]
+        if inspect.ismethod(callback):
+            ref = weakref.WeakMethod(callback)
+        else:
+            ref = lambda: callback  # noqa: E731
+        self._subscribers.setdefault(key, []).append(ref)
+
+    def _notify(self, key: str, value: Optional[str]) -> None:
+        refs = self._subscribers.get(key)
+        if not refs:
+            return
+
+        live = []
+        for ref in refs:
+            callback = ref()
+            if callback is None:
+                continue
+            live.append(ref)
+            try:
+                callback(key, value)
+            except Exception:
+                _LOGGER.exception("Error in subscriber for secret %r", key)
+        self._subscribers[key] = live
+
+    async def watch(self, poll_interval: float = 10.0) -> None:
+        """
+        Watches the secrets directory for changes, and reloads it. This runs
+        until cancelled.
+
+        This polls the directory every `poll_interval` seconds. Where inotify
+        is available, it also reloads as soon as the directory changes.
+        """
+        # Make sure we have a baseline to compare against.
+        if self._values is None:
+            self._values = self._scan()
+
+        fd = _inotify_init(self._root)
+        if fd is None:
+            _LOGGER.info(
+                "Polling %s for changes every %.1f seconds", self._root, poll_interval
+            )
+            while True:
+                await asyncio.sleep(poll_interval)
+                self.reload()
+
+        _LOGGER.info(
+            "Watching %s for changes, and polling every %.1f seconds",
+            self._root,
+            poll_interval,
+        )
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(fd, readable.set)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(readable.wait(), poll_interval)
+                except TimeoutError:
+                    self.reload()
+                    continue
+                # The reader is level-triggered, so stop watching until we've
+                # drained the events, otherwise it's called on every iteration
+                # of the event loop.
+                loop.remove_reader(fd)
+                await asyncio.sleep(_INOTIFY_DEBOUNCE)
+                try:
+                    while os.read(fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                readable.clear()
+                loop.add_reader(fd, readable.set)
+                self.reload()
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+
+
+secret_store = SecretStore()
+"""Default `SecretStore` for `/run/secrets`."""
@@ -0,0 +1,234 @@
+"""
+Worker process supervisor, for zero-downtime reloads.
+
+The supervisor runs the gRPC server in a worker process. On `SIGHUP`, it starts
+a new generation of worker on the same port, waits for it to be ready, and then
+asks the old worker to hand over (`HANDOVER_SIGNAL`): stop accepting
+connections straight away, finish its in-flight requests, and exit.
+
+On `SIGINT` or `SIGTERM`, the supervisor asks the worker to drain fully
+(reporting `NOT_SERVING` to health checks first), then exits. A second `SIGINT`
+or `SIGTERM` stops the workers immediately.
+
+Workers run in their own session, so a `SIGINT` from the terminal only reaches
+the supervisor.
+
+Both generations can listen on the same port at once because gRPC sets
+`SO_REUSEPORT` on its listening sockets.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import sys
+from typing import Optional
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.INFO)
+
+READY_FD_ENV = "GADD_READY_FD"
+"""
+Environment variable containing a file descriptor that a worker writes to once
+it is listening.
+"""
+
+HANDOVER_SIGNAL = signal.SIGUSR1
+"""
+Signal asking a worker to stop accepting connections immediately and exit once
+its in-flight requests finish, because a new worker has taken over its port.
+"""
+
+# How long to wait for a new worker to start listening
+_READY_TIMEOUT = 60.0
+
+_WORKER_ARGS = [sys.executable, "-m", "grpc_asgi_django_demo.server", "--worker"]
+
+
+def notify_ready() -> None:
+    """
+    Tells the supervisor (if any) that this worker is listening.
+    """
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b"1")
+        os.close(int(fd))
+    except OSError:
+        _LOGGER.exception("Unable to notify supervisor")
+
+
+async def _spawn() -> Optional[asyncio.subprocess.Process]:
+    """
+    Starts a new worker, and waits for it to start listening.
+
+    Returns:
+        The worker process, or `None` if it failed to start.
+    """
+    r, w = os.pipe()
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *_WORKER_ARGS,
+            env={**os.environ, READY_FD_ENV: str(w)},
+            pass_fds=(w,),
+            start_new_session=True,
+        )
+    finally:
+        # The worker has its own copy, so reading returns EOF if it exits.
+        os.close(w)
+
+    _LOGGER.info("Started worker %d", proc.pid)
+    loop = asyncio.get_running_loop()
+    read = loop.run_in_executor(None, os.read, r, 1)
+
+    async def kill() -> None:
+        if proc.returncode is None:
+            proc.kill()
+        await proc.wait()
+        # Unblocks once the worker has gone.
+        await read
+        os.close(r)
+
+    try:
+        ready = await asyncio.wait_for(asyncio.shield(read), _READY_TIMEOUT)
+    except TimeoutError:
+        _LOGGER.error("Worker %d didn't start in time", proc.pid)
+        ready = b""
+    except BaseException:
+        # Don't leave the worker running (and holding the port) if we're
+        # cancelled while it starts.
+        await kill()
+        raise
+    if not ready:
+        await kill()
+        return None
+
+    os.close(r)
+    _LOGGER.info("Worker %d is ready", proc.pid)
+    return proc
+
+
+async def _spawn_unless_stopped(
+    stop: asyncio.Event,
+) -> Optional[asyncio.subprocess.Process]:
+    """
+    Starts a new worker, like `_spawn()`, but gives up if `stop` is set before
+    it is ready.
+
+    Returns:
+        The worker process, or `None` if it failed to start or `stop` was set.
+    """
+    spawning = asyncio.create_task(_spawn())
+    stopping = asyncio.create_task(stop.wait())
+    await asyncio.wait((spawning, stopping), return_when=asyncio.FIRST_COMPLETED)
+    stopping.cancel()
+    if not spawning.done():
+        _LOGGER.info("Stopping a worker which hasn't started yet")
+        spawning.cancel()
+        await asyncio.gather(spawning, return_exceptions=True)
+        return None
+    return spawning.result()
+
+
+async def _drain(proc: asyncio.subprocess.Process, handover: bool) -> None:
+    """
+    Asks a worker to exit, and waits for it to do so.
+
+    Args:
+        handover: If `True`, another worker has taken over the port, so the
+            worker stops accepting connections immediately. Otherwise, it
+            drains fully first.
+    """
+    if proc.returncode is None:
+        _LOGGER.info(
+            "%s worker %d", "Handing over from" if handover else "Draining", proc.pid
+        )
+        proc.send_signal(HANDOVER_SIGNAL if handover else signal.SIGTERM)
+    await proc.wait()
+    _LOGGER.info("Worker %d exited with status %d", proc.pid, proc.returncode)
+
+
+async def supervise() -> int:
+    """
+    Runs workers until asked to stop.
+
+    Signals:
+        `SIGHUP`: start a new generation of worker, then hand over from the old
+            one.
+        `SIGINT`, `SIGTERM`: drain the current worker, then exit. Sending one
+            of these again stops all workers immediately.
+
+    Returns:
+        Exit status for the supervisor.
+    """
+    loop = asyncio.get_running_loop()
+    reload = asyncio.Event()
+    stop = asyncio.Event()
+    # All worker processes which haven't exited yet
+    workers: set[asyncio.subprocess.Process] = set()
+
+    def on_stop_signal():
+        if stop.is_set():
+            # Workers stop immediately on their second signal.
+            _LOGGER.warning("Stopping workers immediately")
+            for proc in workers:
+                if proc.returncode is None:
+                    proc.send_signal(signal.SIGTERM)
+        stop.set()
+
+    loop.add_signal_handler(signal.SIGHUP, reload.set)
+    loop.add_signal_handler(signal.SIGINT, on_stop_signal)
+    loop.add_signal_handler(signal.SIGTERM, on_stop_signal)
+
+    # Signal handlers are installed first, so stopping while the first worker
+    # starts up doesn't leave it running.
+    worker = await _spawn_unless_stopped(stop)
+    if worker is None:
+        return 0 if stop.is_set() else 1
+    workers.add(worker)
+
+    draining: set[asyncio.Task[None]] = set()
+
+    async def hand_over(proc: asyncio.subprocess.Process) -> None:
+        await _drain(proc, handover=True)
+        workers.discard(proc)
+
+    while True:
+        exited = asyncio.create_task(worker.wait())
+        reloading = asyncio.create_task(reload.wait())
+        stopping = asyncio.create_task(stop.wait())
+        await asyncio.wait(
+            (exited, reloading, stopping), return_when=asyncio.FIRST_COMPLETED
+        )
+        for t in (exited, reloading, stopping):
+            t.cancel()
+
+        if stop.is_set():
+            await asyncio.gather(_drain(worker, handover=False), *draining)
+            return 0
+
+        if worker.returncode is not None:
+            _LOGGER.error(
+                "Worker %d exited unexpectedly with status %d",
+                worker.pid,
+                worker.returncode,
+            )
+            await asyncio.gather(*draining)
+            return worker.returncode or 1
+
+        reload.clear()
+        _LOGGER.info("Reloading...")
+        new_worker = await _spawn_unless_stopped(stop)
+        if new_worker is None:
+            if not stop.is_set():
+                _LOGGER.error(
+                    "New worker failed to start, keeping worker %d", worker.pid
+                )
+            continue
+
+        task = asyncio.create_task(hand_over(worker))
+        draining.add(task)
+        task.add_done_callback(draining.discard)
+        worker = new_worker
+        workers.add(worker)
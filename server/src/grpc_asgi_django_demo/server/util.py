@@ -2,13 +2,11 @@
 Miscellaneous utility functions.
 """
 
-import functools
 import os
-from pathlib import Path
-from typing import TypeVar
+from typing import Callable, Optional, TypeVar
+
+from .secret_store import secret_store
 
-_SECRET_ROOT = Path("/run/secrets")
-_MAX_ENVIRONMENT_LENGTH = 64 << 10  # is enough for anyone
 _T = TypeVar("_T")
 
 
@@ -18,7 +16,8 @@ def get_env_or_secret(key: str, default: _T = None) -> str | _T:
     This allows environment variables to be passed as regular environment
     variables, or as Docker secrets.
 
-    Environment variables take priority.
+    Environment variables take priority. Secrets are served from the in-memory
+    `secret_store`, which picks up rotated secrets while it is being watched.
     """
 
     if not key:
@@ -32,16 +31,22 @@ def get_env_or_secret(key: str, default: _T = None) -> str | _T:
     v = os.getenv(key)
 
     if v is None:
-        try:
-            with open(_SECRET_ROOT / key, "r") as f:
-                v = f.read(_MAX_ENVIRONMENT_LENGTH)
-        except BaseException:
-            # Silently ignore errors, we can rethrow later.
-            return default
+        return secret_store.get(key, default)
 
     return v
 
 
+def on_secret_change(key: str, callback: Callable[[str, Optional[str]], None]):
+    """
+    Calls `callback(key, value)` when the Docker secret `key` is rotated.
+
+    Nothing is called if `key` is set as an environment variable, because those
+    take priority over secrets and can't change.
+    """
+    if os.getenv(key) is None:
+        secret_store.subscribe(key, callback)
+
+
 def require_env(key: str) -> str:
     """
     Get the environment variable `key`.
@@ -62,7 +67,7 @@ class LazyRequireEnv:
     If the environment variable is unset or empty, `__str__` raises
     `ValueError`.
 
-    The result is cached.
+    The result is cached until the underlying secret is rotated.
 
     The idea of this is that it makes an environment variable required, but only
     if it's actually needed by something.
@@ -70,12 +75,18 @@ class LazyRequireEnv:
 
     def __init__(self, key: str):
         self._key = key
+        self._value: Optional[str] = None
+        on_secret_change(key, self._invalidate)
+
+    def _invalidate(self, key: str, value: Optional[str]) -> None:
+        self._value = None
 
-    @functools.cache
     def __str__(self) -> str:
-        return require_env(self._key)
+        v = self._value
+        if v is None:
+            v = self._value = require_env(self._key)
+        return v
 
-    @functools.cache
     def encode(self, encoding: str = "utf-8", errors: str = "strict") -> bytes:
         v = str(self)
         return v.encode(encoding=encoding, errors=errors)
@@ -86,18 +97,24 @@ class LazyEnv:
 
     If the environment variable is unset, `__str__` returns the default value.
 
-    The result is cached.
+    The result is cached until the underlying secret is rotated.
     """
 
     def __init__(self, key: str, default: str = ""):
         self._key = key
         self._default = default
+        self._value: Optional[str] = None
+        on_secret_change(key, self._invalidate)
+
+    def _invalidate(self, key: str, value: Optional[str]) -> None:
+        self._value = None
 
-    @functools.cache
     def __str__(self) -> str:
-        return get_env_or_secret(self._key, self._default)
+        v = self._value
+        if v is None:
+            v = self._value = get_env_or_secret(self._key, self._default)
+        return v
 
-    @functools.cache
     def encode(self, encoding: str = "utf-8", errors: str = "strict") -> bytes:
         v = str(self)
         return v.encode(encoding=encoding, errors=errors)
@@ -0,0 +1,215 @@
+"""
+Event loop lag watchdog.
+
+When something blocks the event loop (eg: calling the Django ORM synchronously
+from an async view), every gRPC call in the process stalls. The watchdog:
+
+* measures how late the event loop is to wake up a sleeping task ("lag"), and
+  periodically logs lag percentiles
+* captures the event loop thread's stack from a separate thread when the loop
+  has been blocked for too long, to show what was blocking it
+* reports `AsgiService` as `NOT_SERVING` while lag stays above a threshold, so
+  Envoy stops sending us traffic, and reports `SERVING` again once it recovers
+"""
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from grpc_health.v1 import health, health_pb2
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.INFO)
+
+# Number of slow callbacks to keep
+_MAX_SLOW_CALLBACKS = 32
+
+
+@dataclass(slots=True)
+class SlowCallback:
+    """A time when the event loop was blocked."""
+
+    started: float
+    """`time.time()` when the event loop stopped responding."""
+
+    duration: float
+    """How long the event loop was blocked for, in seconds."""
+
+    stack: str
+    """Stack trace of the event loop thread, while it was blocked."""
+
+
+class LoopWatchdog:
+    """
+    Watches an event loop for lag.
+
+    `LoopWatchdog.run()` needs to be run as a task on the event loop being
+    watched.
+    """
+
+    def __init__(
+        self,
+        health_servicer: health.aio.HealthServicer,  # type: ignore
+        service_name: str,
+        interval: float = 0.1,
+        slow_callback: float = 0.25,
+        unhealthy_lag: float = 0.5,
+        unhealthy_period: float = 5.0,
+        recovery_period: float = 10.0,
+        report_interval: float = 60.0,
+    ):
+        """
+        Args:
+            health_servicer: Health service to report lag to.
+            service_name: Service name to report to `health_servicer`.
+            interval: How often to measure lag, in seconds.
+            slow_callback: Capture the event loop's stack when it has been
+                blocked for this many seconds.
+            unhealthy_lag: Lag threshold for reporting `NOT_SERVING`.
+            unhealthy_period: Report `NOT_SERVING` once lag has been over
+                `unhealthy_lag` for this many seconds.
+            recovery_period: Report `SERVING` again once lag has been under
+                `unhealthy_lag` for this many seconds.
+            report_interval: How often to log lag percentiles, in seconds.
+        """
+        self._health_servicer = health_servicer
+        self._service_name = service_name
+        self._interval = interval
+        self._slow_callback = slow_callback
+        self._unhealthy_lag = unhealthy_lag
+        self._unhealthy_period = unhealthy_period
+        self._recovery_period = recovery_period
+        self._report_interval = report_interval
+
+        # Keep about one reporting interval of samples.
+        self._samples: deque[float] = deque(
+            maxlen=max(1, int(report_interval / interval))
+        )
+        self.slow_callbacks: deque[SlowCallback] = deque(maxlen=_MAX_SLOW_CALLBACKS)
+        self.serving = True
+
+        self._heartbeat = time.monotonic()
+        self._stop = threading.Event()
+
+    def lag_percentiles(self) -> dict[str, float]:
+        """
+        Returns the p50, p90, p99 and maximum event loop lag (in seconds) over
+        the last reporting interval.
+        """
+        samples = sorted(self._samples)
+        if not samples:
+            return {}
+        n = len(samples) - 1
+        return {
+            "p50": samples[n * 50 // 100],
+            "p90": samples[n * 90 // 100],
+            "p99": samples[n * 99 // 100],
+            "max": samples[n],
+        }
+
+    def _monitor(self, loop_thread_id: int) -> None:
+        """
+        Captures the event loop thread's stack when it stops responding.
+
+        This runs in a separate thread.
+        """
+        blocked: Optional[SlowCallback] = None
+        while not self._stop.wait(self._interval):
+            stalled = time.monotonic() - self._heartbeat - self._interval
+            if stalled < self._slow_callback:
+                if blocked is not None:
+                    _LOGGER.warning(
+                        "Event loop was blocked for %.3f seconds", blocked.duration
+                    )
+                    blocked = None
+                continue
+
+            if blocked is not None:
+                blocked.duration = stalled
+                continue
+
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is None:
+                continue
+            blocked = SlowCallback(
+                started=time.time() - stalled,
+                duration=stalled,
+                stack="".join(traceback.format_stack(frame)),
+            )
+            del frame
+            self.slow_callbacks.append(blocked)
+            _LOGGER.warning(
+                "Event loop blocked for %.3f seconds, in:\n%s", stalled, blocked.stack
+            )
+
+    async def _set_serving(self, serving: bool) -> None:
+        self.serving = serving
+        await self._health_servicer.set(
+            self._service_name,
+            health_pb2.HealthCheckResponse.SERVING
+            if serving
+            else health_pb2.HealthCheckResponse.NOT_SERVING,
+        )
+
+    async def run(self) -> None:
+        """Watches the current event loop. This runs until cancelled."""
+        loop = asyncio.get_running_loop()
+        monitor = threading.Thread(
+            target=self._monitor,
+            args=(threading.get_ident(),),
+            name="LoopWatchdog",
+            daemon=True,
+        )
+        self._stop.clear()
+        self._heartbeat = time.monotonic()
+        monitor.start()
+
+        # When lag last crossed `unhealthy_lag`
+        changed = loop.time()
+        next_report = changed + self._report_interval
+        try:
+            while True:
+                start = loop.time()
+                await asyncio.sleep(self._interval)
+                now = loop.time()
+                self._heartbeat = time.monotonic()
+                lag = max(0.0, now - start - self._interval)
+                self._samples.append(lag)
+
+                over = lag > self._unhealthy_lag
+                if over == self.serving:
+                    # Lag crossed the threshold, in the "wrong" direction for
+                    # our current state.
+                    period = (
+                        self._unhealthy_period
+                        if self.serving
+                        else self._recovery_period
+                    )
+                    if now - changed >= period:
+                        _LOGGER.warning(
+                            "Event loop lag %.3f seconds, reporting %s",
+                            lag,
+                            "NOT_SERVING" if over else "SERVING",
+                        )
+                        await self._set_serving(not over)
+                        changed = now
+                else:
+                    changed = now
+
+                if now >= next_report:
+                    next_report = now + self._report_interval
+                    _LOGGER.info(
+                        "Event loop lag: %s",
+                        ", ".join(
+                            f"{k}={v * 1000:.1f}ms"
+                            for k, v in self.lag_percentiles().items()
+                        ),
+                    )
+        finally:
+            self._stop.set()
@@ -0,0 +1,69 @@
+"""
+Tests for `PooledApplication` in `threads` mode, with the demo's Django app.
+
+Run with: `python -m unittest discover -s tests`
+"""
+
+import os
+import unittest
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+from grpc_asgi_django_demo.server.asgi_pool import PooledApplication  # noqa: E402
+
+
+def _scope(path: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.0"},
+        "http_version": "2",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("latin1"),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("localhost", 8081),
+        "extensions": {},
+    }
+
+
+class ThreadsPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = PooledApplication("threads", 2)
+
+    async def asyncTearDown(self):
+        self.pool.close()
+
+    async def request(self, path: str) -> tuple[int, bytes]:
+        events = [{"type": "http.request", "body": b"", "more_body": False}]
+        sent: list[dict] = []
+
+        async def receive():
+            return events.pop(0) if events else {"type": "http.disconnect"}
+
+        async def send(evt):
+            sent.append(evt)
+
+        await self.pool(_scope(path), receive, send)
+        self.assertEqual(
+            [e["type"] for e in sent], ["http.response.start", "http.response.body"]
+        )
+        return sent[0]["status"], sent[1]["body"]
+
+    async def test_request(self):
+        self.assertEqual(await self.request("/ok"), (200, b"OK"))
+
+    async def test_not_found(self):
+        status, _ = await self.request("/missing")
+        self.assertEqual(status, 404)
+
+    async def test_websocket_rejected(self):
+        with self.assertRaises(ValueError):
+            await self.pool({"type": "websocket"}, None, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
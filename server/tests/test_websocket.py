@@ -0,0 +1,109 @@
+"""
+Tests for `AsgiWebSocketService`, using an in-process gRPC server and client.
+
+Run with: `python -m unittest discover -s tests`
+"""
+
+import unittest
+
+import grpc
+
+from grpc_asgi_django_demo.proto.v1 import service_pb2, service_pb2_grpc
+from grpc_asgi_django_demo.server import asgi_impl
+
+_METADATA = (
+    ("x-envoy-original-method", "GET"),
+    ("x-envoy-original-path", "/ws/"),
+    ("x-forwarded-host", "localhost"),
+)
+
+
+async def echo_app(scope, receive, send):
+    """
+    WebSocket application which echoes messages back to the client, and rejects
+    connections to `/reject/`.
+    """
+    assert scope["type"] == "websocket"
+    assert (await receive())["type"] == "websocket.connect"
+    if scope["path"] == "/reject/":
+        await send({"type": "websocket.close", "code": 1000})
+        return
+
+    await send({"type": "websocket.accept"})
+    while True:
+        event = await receive()
+        if event["type"] == "websocket.disconnect":
+            # Tell the client how we were disconnected.
+            await send({"type": "websocket.send", "text": f"bye {event['code']}"})
+            return
+        if event.get("bytes") is not None:
+            await send({"type": "websocket.send", "bytes": event["bytes"]})
+        else:
+            await send({"type": "websocket.send", "text": event["text"]})
+
+
+def _initial_status(metadata) -> str:
+    return metadata["x-http-code"]
+
+
+class WebSocketTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = grpc.aio.server()
+        port = self.server.add_insecure_port("127.0.0.1:0")
+        service_pb2_grpc.add_AsgiWebSocketServiceServicer_to_server(
+            asgi_impl.AsgiWebSocketServiceImpl(echo_app, port), self.server
+        )
+        await self.server.start()
+        self.channel = grpc.aio.insecure_channel(f"127.0.0.1:{port}")
+        self.stub = service_pb2_grpc.AsgiWebSocketServiceStub(self.channel)
+
+    async def asyncTearDown(self):
+        await self.channel.close()
+        await self.server.stop(None)
+
+    async def test_echo_and_close(self):
+        call = self.stub.Connect(metadata=_METADATA)
+        self.assertEqual(_initial_status(await call.initial_metadata()), "101")
+
+        await call.write(service_pb2.WebSocketMessage(text="hello"))
+        self.assertEqual((await call.read()).text, "hello")
+
+        await call.write(service_pb2.WebSocketMessage(bytes=b"\x00\xff"))
+        self.assertEqual((await call.read()).bytes, b"\x00\xff")
+
+        await call.write(
+            service_pb2.WebSocketMessage(
+                close=service_pb2.WebSocketClose(code=4000, reason="done")
+            )
+        )
+        self.assertEqual((await call.read()).text, "bye 4000")
+        await call.done_writing()
+        self.assertIs(await call.read(), grpc.aio.EOF)
+        self.assertEqual(await call.code(), grpc.StatusCode.OK)
+
+    async def test_client_eof(self):
+        call = self.stub.Connect(metadata=_METADATA)
+        self.assertEqual(_initial_status(await call.initial_metadata()), "101")
+
+        # Ending the stream without a close message is "No Status Rcvd".
+        await call.done_writing()
+        self.assertEqual((await call.read()).text, "bye 1005")
+        self.assertIs(await call.read(), grpc.aio.EOF)
+        self.assertEqual(await call.code(), grpc.StatusCode.OK)
+
+    async def test_reject(self):
+        call = self.stub.Connect(
+            metadata=(
+                ("x-envoy-original-method", "GET"),
+                ("x-envoy-original-path", "/reject/"),
+                ("x-forwarded-host", "localhost"),
+            )
+        )
+        self.assertEqual(_initial_status(await call.initial_metadata()), "403")
+        await call.done_writing()
+        self.assertIs(await call.read(), grpc.aio.EOF)
+        self.assertEqual(await call.code(), grpc.StatusCode.OK)
+
+
+if __name__ == "__main__":
+    unittest.main()